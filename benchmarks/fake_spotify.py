@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""fake_spotify
+
+Stand-in for Spotify's MPRIS interface, on the session bus of $DBUS_SESSION_BUS_ADDRESS.
+It plays a scripted sequence of songs, ads and podcast episodes, optionally
+sending bursts of duplicate signals and restarting every few tracks.
+
+Every step is printed on stdout with the time it happened:
+    owned <time>, released <time>, sent <kind> <trackid> <time>, done <time>
+
+Usage:
+    fake_spotify.py [--tracks=<n>] [--interval=<ms>] [--burst=<n>] [--restart-every=<n>]
+                    [--restart-delay=<ms>] [--start-delay=<ms>] [--pattern=<kinds>]
+
+Options:
+    --tracks=<n>           Number of tracks to play. [default: 100]
+    --interval=<ms>        Time between two tracks. [default: 50]
+    --burst=<n>            Number of Metadata signals sent for each track. [default: 1]
+    --restart-every=<n>    Restart every n tracks, i.e. release and take back the bus name. 0 never restarts. [default: 0]
+    --restart-delay=<ms>   How long Spotify stays closed when restarting. [default: 500]
+    --start-delay=<ms>     Time to wait before the first track, e.g. for blockify to connect. [default: 1000]
+    --pattern=<kinds>      Comma-separated cycle of kinds of track: song, ad or episode. [default: song,ad,song,episode]
+"""
+import sys
+import time
+
+import dbus
+import dbus.service
+from dbus.mainloop.glib import DBusGMainLoop
+from docopt import docopt
+from gi.repository import GLib
+
+SPOTIFY = "org.mpris.MediaPlayer2.spotify"
+ROOT = "org.mpris.MediaPlayer2"
+PLAYER = "org.mpris.MediaPlayer2.Player"
+
+
+class FakeSpotify(dbus.service.Object):
+    def __init__(self, bus):
+        super().__init__(bus, "/org/mpris/MediaPlayer2")
+        self.bus = bus
+        self.properties = {
+            ROOT: {"Identity": "Spotify", "CanQuit": True, "CanRaise": False},
+            PLAYER: {
+                "PlaybackStatus": "Stopped",
+                "Metadata": dbus.Dictionary({}, signature="sv"),
+                "Position": dbus.Int64(0),
+                "CanGoNext": True, "CanGoPrevious": True, "CanPlay": True, "CanPause": True, "CanSeek": True,
+            },
+        }
+
+    def own_name(self):
+        self.bus.request_name(SPOTIFY, dbus.bus.NAME_FLAG_DO_NOT_QUEUE)
+        print(f"owned {time.time()}", flush=True)
+
+    def release_name(self):
+        self.bus.release_name(SPOTIFY)
+        print(f"released {time.time()}", flush=True)
+
+    def play_track(self, kind, i, burst):
+        metadata = track_metadata(kind, i)
+        print(f"sent {kind} {metadata['mpris:trackid']} {time.time()}", flush=True)
+        self.properties[PLAYER]["Metadata"] = metadata
+        self.properties[PLAYER]["PlaybackStatus"] = "Playing"
+        for _ in range(burst):
+            self.PropertiesChanged(PLAYER, {"Metadata": metadata}, [])
+        self.PropertiesChanged(PLAYER, {"PlaybackStatus": "Playing"}, [])
+
+    def set_status(self, status):
+        self.properties[PLAYER]["PlaybackStatus"] = status
+        self.PropertiesChanged(PLAYER, {"PlaybackStatus": status}, [])
+
+    @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature="ss", out_signature="v")
+    def Get(self, interface, prop):
+        return self.properties[interface][prop]
+
+    @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature="s", out_signature="a{sv}")
+    def GetAll(self, interface):
+        return self.properties[interface]
+
+    @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature="ssv")
+    def Set(self, interface, prop, value):
+        self.properties[interface][prop] = value
+        self.PropertiesChanged(interface, {prop: value}, [])
+
+    @dbus.service.signal(dbus.PROPERTIES_IFACE, signature="sa{sv}as")
+    def PropertiesChanged(self, interface, changed_properties, invalidated_properties):
+        pass
+
+    @dbus.service.signal(PLAYER, signature="x")
+    def Seeked(self, position):
+        pass
+
+    @dbus.service.method(PLAYER)
+    def Play(self):
+        self.set_status("Playing")
+
+    @dbus.service.method(PLAYER)
+    def Pause(self):
+        self.set_status("Paused")
+
+    @dbus.service.method(PLAYER)
+    def PlayPause(self):
+        self.set_status("Paused" if self.properties[PLAYER]["PlaybackStatus"] == "Playing" else "Playing")
+
+    @dbus.service.method(PLAYER)
+    def Stop(self):
+        self.set_status("Stopped")
+
+    @dbus.service.method(PLAYER)
+    def Next(self):
+        pass
+
+    @dbus.service.method(PLAYER)
+    def Previous(self):
+        pass
+
+    @dbus.service.method(PLAYER, in_signature="x")
+    def Seek(self, offset):
+        self.Seeked(self.properties[PLAYER]["Position"] + offset)
+
+    @dbus.service.method(PLAYER, in_signature="ox")
+    def SetPosition(self, track_id, position):
+        self.Seeked(position)
+
+    @dbus.service.method(PLAYER, in_signature="s")
+    def OpenUri(self, uri):
+        pass
+
+
+def track_metadata(kind, i):
+    if kind == "ad":
+        url, artist, title = f"https://open.spotify.com/ad/{i}", "", "Advertisement"
+    elif kind == "episode":
+        url, artist, title = f"https://open.spotify.com/episode/{i}", "", f"Episode {i}"
+    else:
+        url, artist, title = f"https://open.spotify.com/track/{i}", f"Artist {i}", f"Song {i}"
+    return dbus.Dictionary({
+        "mpris:trackid": dbus.ObjectPath(f"/com/spotify/{kind}/{i}"),
+        "mpris:length": dbus.UInt64(180_000_000),
+        "xesam:url": url,
+        "xesam:title": title,
+        "xesam:album": f"Album {i}",
+        "xesam:artist": dbus.Array([artist], signature="s"),
+    }, signature="sv")
+
+
+def scenario(spotify, args):
+    """Plays the tracks, yielding how long to wait (in ms) before the next step."""
+    kinds = args["--pattern"].split(",")
+    interval, burst = int(args["--interval"]), int(args["--burst"])
+    restart_every, restart_delay = int(args["--restart-every"]), int(args["--restart-delay"])
+    yield int(args["--start-delay"])
+    for i in range(int(args["--tracks"])):
+        if restart_every and i and i % restart_every == 0:
+            spotify.release_name()
+            yield restart_delay
+            spotify.own_name()
+        spotify.play_track(kinds[i % len(kinds)], i, burst)
+        yield interval
+
+
+def main():
+    args = docopt(__doc__)
+    DBusGMainLoop(set_as_default=True)
+    main_loop = GLib.MainLoop()
+    spotify = FakeSpotify(dbus.SessionBus())
+    spotify.own_name()
+    steps = scenario(spotify, args)
+
+    def next_step():
+        try:
+            GLib.timeout_add(next(steps), next_step)
+        except StopIteration:
+            print(f"done {time.time()}", flush=True)
+            main_loop.quit()
+        return False
+
+    GLib.idle_add(next_step)
+    main_loop.run()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""import_time
+
+Measures the cold start of blockify's commands with "python -X importtime" and
+exits with an error if any of them spends more than the budget importing
+modules, e.g. to catch a heavy dependency imported at startup again.
+
+Usage:
+    import_time.py [--budget=<ms>] [--runs=<n>] [--top=<n>]
+
+Options:
+    --budget=<ms>  Maximum time each command can spend importing modules. [default: 150]
+    --runs=<n>     Runs of each command, of which the fastest is kept. [default: 5]
+    --top=<n>      Number of slowest imports to show for each command. [default: 5]
+"""
+import subprocess
+import sys
+import time
+
+from docopt import docopt
+
+COMMANDS = {
+    "blockify --version": ["-m", "blockify.cli", "--version"],
+    "dbusclient get status": ["-m", "blockify.dbusclient", "get", "status", "--quiet"],
+}
+
+
+def parse_importtime(stderr: str) -> list[tuple[str, int]]:
+    """Returns the top-level imports done after the interpreter started, with their cumulative time in us."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, package = line.split("|")
+        if not cumulative.strip().isdigit() or package.startswith("  "):
+            continue
+        if package.strip() == "site":
+            imports.clear()  # everything up to site is the interpreter's own startup
+            continue
+        imports.append((package.strip(), int(cumulative)))
+    return imports
+
+
+def measure(arguments: list[str], runs: int):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, "-X", "importtime", *arguments],
+                                 capture_output=True, text=True, timeout=30)
+        elapsed = time.perf_counter() - start
+        imports = parse_importtime(process.stderr)
+        total = sum(cumulative for _, cumulative in imports)
+        if best is None or total < best[0]:
+            best = (total, elapsed, imports)
+    return best
+
+
+def main():
+    args = docopt(__doc__)
+    budget, runs, top = int(args["--budget"]), int(args["--runs"]), int(args["--top"])
+    over_budget = []
+    for name, arguments in COMMANDS.items():
+        total, elapsed, imports = measure(arguments, runs)
+        print(f"{name:<24} imports {total / 1000:>7.1f} ms   wall {elapsed * 1000:>7.1f} ms")
+        for package, cumulative in sorted(imports, key=lambda item: item[1], reverse=True)[:top]:
+            print(f"    {package:<30} {cumulative / 1000:>7.1f} ms")
+        if total / 1000 > budget:
+            over_budget.append(name)
+    if over_budget:
+        print(f"Over the budget of {budget} ms: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""matcher_equivalence
+
+Checks on random blocklists and songs that the indexed matchers find the same
+entry as the linear scans they replaced, also after entries are removed, added
+back and duplicated the way Blocklist does it. Exits with an error at the first
+difference, printing the operations that led to it.
+
+Usage:
+    matcher_equivalence.py [--trials=<n>] [--seed=<seed>]
+
+Options:
+    --trials=<n>   Random blocklists to check, for each matcher. [default: 2000]
+    --seed=<seed>  Seed of the random generator, to reproduce a failure. [default: 0]
+"""
+import random
+import sys
+
+from docopt import docopt
+
+from blockify.matchers import PrefixMatcher, SubstringMatcher
+
+# Few characters, so that entries and songs often share prefixes and substrings.
+ALPHABET = "ab -"
+
+
+def scan_prefix(items: list[str], song: str) -> str | None:
+    """Blocklist.find before the prefix index."""
+    # Arbitrary minimum length of 4 to avoid ambiguous song names.
+    while len(song) > 4:
+        for item in items:
+            if item.startswith(song):
+                return item
+        song = song[:int(len(song) / 2)]
+    return None
+
+
+def scan_substring(items: list[str], song: str) -> str | None:
+    """Blocklist.find with substring_search, before the Aho-Corasick automaton."""
+    for item in items:
+        if item in song:
+            return item
+    return None
+
+
+def random_string(rng: random.Random, max_length: int) -> str:
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, max_length)))
+
+
+def check(matcher_class, scan, rng: random.Random) -> list[str] | None:
+    """Runs random operations on a blocklist, returning them if the matcher disagrees with the scan."""
+    # Duplicates happen when the file is edited by hand: Blocklist loads them as they are.
+    items = [random_string(rng, 12) for _ in range(rng.randint(0, 12))]
+    items += rng.sample(items, k=min(len(items), rng.randint(0, 3)))
+    rng.shuffle(items)
+    matcher = matcher_class(items)
+    operations = [f"load {items!r}"]
+    for _ in range(30):
+        operation = rng.random()
+        if operation < 0.25:
+            # Blocklist.append ignores duplicates.
+            item = rng.choice(items) if items and rng.random() < 0.3 else random_string(rng, 12)
+            operations.append(f"append {item!r}")
+            if item not in items:
+                items.append(item)
+                matcher.add(item)
+        elif operation < 0.5 and items:
+            # Blocklist.remove, then maybe added back at the end.
+            item = rng.choice(items)
+            operations.append(f"remove {item!r}")
+            items.remove(item)
+            if item in items:
+                # A later duplicate took its place: Blocklist rebuilds the matcher.
+                matcher = matcher_class(items)
+            else:
+                matcher.discard(item)
+            if item not in items and rng.random() < 0.5:
+                operations.append(f"append {item!r}")
+                items.append(item)
+                matcher.add(item)
+        else:
+            song = random_string(rng, 24)
+            # Songs that contain or start with an entry, besides random ones.
+            if items and rng.random() < 0.5:
+                item = rng.choice(items)
+                if scan is scan_substring:
+                    song = random_string(rng, 6) + item + random_string(rng, 6)
+                else:
+                    song = item[:rng.randint(1, len(item))] + song
+            expected, found = scan(items, song), matcher.find(song)
+            if expected != found:
+                operations.append(f"find {song!r}: expected {expected!r}, found {found!r}")
+                return operations
+    return None
+
+
+def main():
+    args = docopt(__doc__)
+    trials = int(args["--trials"])
+    rng = random.Random(int(args["--seed"]))
+    for matcher_class, scan in ((PrefixMatcher, scan_prefix), (SubstringMatcher, scan_substring)):
+        for trial in range(trials):
+            operations = check(matcher_class, scan, rng)
+            if operations is not None:
+                print(f"{matcher_class.__name__} differs from the linear scan in trial {trial}:")
+                print("\n".join(f"    {operation}" for operation in operations))
+                sys.exit(1)
+        print(f"{matcher_class.__name__}: same results as the linear scan in {trials} random blocklists.")
+
+
+if __name__ == "__main__":
+    main()
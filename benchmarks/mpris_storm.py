@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""mpris_storm
+
+Runs blockify against fake_spotify.py on a private dbus-daemon, offline, and
+measures how fast it detects ads under storms of events and how long it takes
+to handle tracks again after Spotify restarts. Muting is only recorded, not performed.
+
+Usage:
+    mpris_storm.py [--tracks=<n>] [--interval=<ms>] [--burst=<n>] [--restart-every=<n>]
+                   [--restart-delay=<ms>] [--pattern=<kinds>] [--backend=<name>]
+
+Options:
+    --tracks=<n>           Number of tracks played by the fake Spotify. [default: 500]
+    --interval=<ms>        Time between two tracks. [default: 10]
+    --burst=<n>            Number of Metadata signals sent for each track. [default: 5]
+    --restart-every=<n>    Restart Spotify every n tracks. 0 never restarts. [default: 100]
+    --restart-delay=<ms>   How long Spotify stays closed when restarting. [default: 200]
+    --pattern=<kinds>      Comma-separated cycle of kinds of track: song, ad or episode. [default: song,ad,song,episode]
+    --backend=<name>       DBus backend of blockify: dbus-python or jeepney. [default: dbus-python]
+"""
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from pathlib import Path
+
+from docopt import docopt
+from blockify import blocklist, cli, util
+
+
+class RecordingMuter():
+    """Muter that only keeps track of its state."""
+    def __init__(self):
+        self.is_muted = False
+
+    def update(self):
+        pass
+
+    def mute(self):
+        self.is_muted = True
+
+    def unmute(self):
+        self.is_muted = False
+
+    def close(self):
+        pass
+
+
+class StormBlockify(cli.Blockify):
+    """Blockify that records what it decides for each track."""
+    def __init__(self):
+        self.decided = {}       # track id -> (time of the first decision, blocked)
+        self.checks = 0
+        super().__init__(blocklist.Blocklist())
+
+    def choose_muter(self):
+        return RecordingMuter()
+
+    def check_spotify(self, changed_metadata=None):
+        super().check_spotify(changed_metadata)
+        self.checks += 1
+        track_id = self.spotify.get_track_id(changed_metadata)
+        self.decided.setdefault(track_id, (time.time(), self.blocking))
+
+
+def start_bus():
+    """Starts a private session bus and makes it the one everything in this process connects to."""
+    daemon = subprocess.Popen(["dbus-daemon", "--session", "--nofork", "--print-address=1"],
+                              stdout=subprocess.PIPE, text=True)
+    os.environ["DBUS_SESSION_BUS_ADDRESS"] = daemon.stdout.readline().strip()
+    return daemon
+
+
+def start_fake_spotify(args):
+    options = [f"{option}={args[option]}" for option in
+               ("--tracks", "--interval", "--burst", "--restart-every", "--restart-delay", "--pattern")]
+    fake = subprocess.Popen([sys.executable, str(Path(__file__).parent/"fake_spotify.py"), *options],
+                            stdout=subprocess.PIPE, text=True)
+    fake.stdout.readline()  # owned: blockify can connect
+    steps = []
+    threading.Thread(target=lambda: steps.extend(line.split() for line in fake.stdout), daemon=True).start()
+    return fake, steps
+
+
+def percentiles(values):
+    if len(values) < 2:
+        return "n/a"
+    quantiles = statistics.quantiles(values, n=100)
+    return f"p50 {quantiles[49] * 1000:8.2f} ms   p99 {quantiles[98] * 1000:8.2f} ms   max {max(values) * 1000:8.2f} ms"
+
+
+def report(blockify, steps):
+    sent = {step[2]: (step[1], float(step[3])) for step in steps if step[0] == "sent"}
+    ads = [track_id for track_id, (kind, _) in sent.items() if kind == "ad"]
+    decided = {track_id: decision for track_id, decision in blockify.decided.items() if track_id in sent}
+    muted_ads = [track_id for track_id in ads if decided.get(track_id, (0, False))[1]]
+    wrongly_muted = [track_id for track_id, (_, blocked) in decided.items() if blocked and sent[track_id][0] != "ad"]
+    latencies = [decided_at - sent[track_id][1] for track_id, (decided_at, _) in decided.items()]
+    first_sent = min((sent_at for _, sent_at in sent.values()), default=0)
+    last_decided = max((decided_at for decided_at, _ in decided.values()), default=0)
+    duration = last_decided - first_sent
+    # Time from each restart to the first decision about a track sent after it.
+    owned = [float(step[1]) for step in steps if step[0] == "owned"]
+    recoveries = []
+    for owned_at in owned:
+        decided_after = [decided_at for track_id, (decided_at, _) in decided.items() if sent[track_id][1] >= owned_at]
+        if decided_after:
+            recoveries.append(min(decided_after) - owned_at)
+
+    print(f"tracks sent         {len(sent)} ({len(ads)} ads)")
+    print(f"tracks missed       {len(sent) - len(decided)}")
+    print(f"ads muted           {len(muted_ads)}/{len(ads)}, {len(wrongly_muted)} other tracks muted")
+    print(f"checks              {blockify.checks}" + (f", {blockify.checks / duration:.0f}/s" if duration > 0 else ""))
+    print(f"detection latency   {percentiles(latencies)}")
+    print(f"recovery latency    {percentiles(recoveries)} ({len(owned)} restarts, {len(recoveries)} recovered)")
+
+
+def main():
+    args = docopt(__doc__)
+    logging.disable(logging.CRITICAL)
+    daemon = start_bus()
+    try:
+        with tempfile.TemporaryDirectory(prefix="blockify-bench-") as directory:
+            util.CONFIG = util.default_options()
+            util.CONFIG["general"]["autoplay"] = False
+            util.CONFIG["general"]["watch_blocklist"] = False
+            util.CONFIG["cli"]["decision_cache_size"] = 0
+            util.CONFIG["cli"]["dbus_backend"] = args["--backend"]
+            # The user's blockify may be listening on the control socket.
+            util.CONFIG["cli"]["control_socket"] = False
+            util.BLOCKLIST_FILE = Path(directory)/"blocklist.txt"
+            util.BLOCKLIST_JOURNAL_FILE = Path(directory)/"blocklist.journal"
+
+            fake, steps = start_fake_spotify(args)
+            blockify = StormBlockify()
+
+            def quit_when_done():
+                if fake.poll() is None:
+                    return True
+                # Leaves some time to the signals still queued.
+                blockify.main_loop.timeout_add(500, blockify.main_loop.quit)
+                return False
+
+            blockify.main_loop.timeout_add(100, quit_when_done)
+            blockify.start()
+            report(blockify, steps)
+    finally:
+        daemon.terminate()
+
+
+if __name__ == "__main__":
+    main()
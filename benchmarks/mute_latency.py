@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""mute_latency
+
+Measures the time from the metadata of an ad reaching Blockify.check_spotify
+to the actual mute command, for each muter. pactl, amixer, pw-dump and pw-cli
+are replaced by stubs that log when they are spawned and print canned outputs
+of the given size.
+
+The alsa muter goes through the real alsa-lib, which can't be stubbed: it mutes
+and unmutes the host's Master, Speaker and Headphone for real, so it's measured
+only if asked for.
+
+Usage:
+    mute_latency.py [--events=<n>] [--clients=<n>] [--sinks=<n>] [--format=<fmt>] [--muters=<names>]
+
+Options:
+    --events=<n>      Number of ads to mute with each muter. [default: 100]
+    --clients=<n>     Number of pulse clients, 1 in 10 being spotify. [default: 50]
+    --sinks=<n>       Number of sink-inputs, spread over the clients, and of PipeWire stream nodes. [default: 200]
+    --format=<fmt>    Output format of the stub pactl: text or json. [default: text]
+    --muters=<names>  Comma-separated muters to measure, among pulse, pulse-subscribe, amixer (AlsaMuter
+                      without alsa-lib), pipewire and alsa (the host's mixer, see above).
+                      [default: pulse,pulse-subscribe,amixer,pipewire]
+"""
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+from docopt import docopt
+
+from blockify import blocklist, cli, dbusclient, muters, util
+from pactl_parsing import json_clients, json_sinks, text_clients, text_sinks
+
+
+class BenchBlockify(cli.Blockify):
+    """Blockify with the given muter and no connection to Spotify: metadata is passed to check_spotify()."""
+    def __init__(self, muter):
+        self.bench_muter = muter
+        super().__init__(blocklist.Blocklist())
+
+    def choose_muter(self):
+        return self.bench_muter
+
+    def connect_to_spotify(self):
+        return dbusclient.SpotifyDBusClient()
+
+
+def amixer_controls():
+    controls = ["Master", "Headphone", "Speaker", "PCM", "Front", "Surround", "Center", "LFE", "Line", "Mic"]
+    return "".join(
+        f"Simple mixer control '{control}',0\n"
+        f"  Capabilities: pvolume pswitch\n"
+        f"  Playback channels: Front Left - Front Right\n"
+        f"  Limits: Playback 0 - 87\n"
+        f"  Front Left: Playback 87 [100%] [0.00dB] [on]\n"
+        f"  Front Right: Playback 87 [100%] [0.00dB] [on]\n"
+        for control in controls
+    )
+
+
+def pw_dump_nodes(n_nodes: int) -> str:
+    """Output of "pw-dump": audio stream nodes, 1 in 10 being spotify's."""
+    nodes = [
+        {
+            "id": 100 + i,
+            "type": "PipeWire:Interface:Node",
+            "info": {
+                "props": {
+                    "media.class": "Stream/Output/Audio",
+                    "application.name": "spotify" if i % 10 == 0 else f"app{i}",
+                    "application.process.binary": "spotify" if i % 10 == 0 else f"app{i}",
+                },
+                "params": {"Props": [{"volume": 1.0, "mute": False}]},
+            },
+        }
+        for i in range(n_nodes)
+    ]
+    return json.dumps(nodes, indent=2) + "\n"
+
+
+def install_stubs(directory: Path, args):
+    stub = (Path(__file__).parent/"stub_mixer.py").read_text()
+    for command in ("pactl", "amixer", "pw-dump", "pw-cli"):
+        path = directory/command
+        path.write_text(f"#!{sys.executable} -IS\n" + stub)
+        path.chmod(0o755)
+    n_clients, n_sinks = int(args["--clients"]), int(args["--sinks"])
+    (directory/"pactl-clients.txt").write_text(text_clients(n_clients))
+    (directory/"pactl-sink-inputs.txt").write_text(text_sinks(n_sinks, n_clients))
+    if args["--format"] == "json":
+        (directory/"pactl-clients.json").write_text(json_clients(n_clients))
+        (directory/"pactl-sink-inputs.json").write_text(json_sinks(n_sinks, n_clients))
+    (directory/"amixer.txt").write_text(amixer_controls())
+    (directory/"pw-dump.json").write_text(pw_dump_nodes(n_sinks))
+    (directory/"calls.log").touch()
+    os.environ["BLOCKIFY_BENCH_DIR"] = str(directory)
+    os.environ["PATH"] = f"{directory}{os.pathsep}{os.environ['PATH']}"
+
+
+def create_muter(name):
+    if name == "pulse":
+        return muters.PulseMuter()
+    if name == "pulse-subscribe":
+        return muters.PulseMuter(subscribe=True)
+    if name == "pipewire":
+        return muters.PipeWireMuter()
+    if name == "alsa":
+        return muters.AlsaMuter()
+    if name == "amixer":
+        def no_alsa_lib():
+            raise OSError("disabled by the benchmark")
+        alsa_mixer = muters.AlsaMixer
+        muters.AlsaMixer = no_alsa_lib  # AlsaMuter falls back to amixer when alsa-lib can't be used
+        try:
+            return muters.AlsaMuter()
+        finally:
+            muters.AlsaMixer = alsa_mixer
+    raise ValueError(f"Unknown muter: {name}")
+
+
+def ad_metadata(i):
+    return {"mpris:trackid": f"/com/spotify/ad/{i}", "xesam:url": f"https://open.spotify.com/ad/{i}",
+            "xesam:title": "Advertisement", "xesam:artist": [""], "mpris:length": 30_000_000}
+
+
+def song_metadata(i):
+    return {"mpris:trackid": f"/com/spotify/track/{i}", "xesam:url": f"https://open.spotify.com/track/{i}",
+            "xesam:title": f"Song {i}", "xesam:artist": [f"Artist {i}"], "mpris:length": 180_000_000}
+
+
+def is_mute(call: str):
+    if call.startswith("pw-cli"):
+        return "mute: true" in call
+    return ("set-sink-input-mute" in call and call.endswith(" yes")) or " mute" in call
+
+
+def measure(blockify, calls_log: Path, events: int):
+    latencies, spawns = [], []
+    for i in range(events):
+        with open(calls_log) as f:
+            f.seek(0, os.SEEK_END)
+            start = time.time()
+            blockify.check_spotify(ad_metadata(i))
+            end = time.time()
+            calls = [line.rstrip("\n").split(" ", 1) for line in f]
+        mutes = [float(started) for started, call in calls if is_mute(call)]
+        # Muters that don't spawn anything are done when check_spotify() returns.
+        latencies.append((mutes[0] if mutes else end) - start)
+        spawns.append(len(calls))
+        # Back to a regular, unmuted song before the next ad.
+        blockify.check_spotify(song_metadata(i))
+        blockify.unmute_with_delay()
+    return latencies, spawns
+
+
+def main():
+    args = docopt(__doc__)
+    logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory(prefix="blockify-bench-") as directory:
+        directory = Path(directory)
+        install_stubs(directory, args)
+        util.CONFIG = util.default_options()
+        util.CONFIG["general"]["watch_blocklist"] = False
+        util.BLOCKLIST_FILE = directory/"blocklist.txt"
+        util.BLOCKLIST_JOURNAL_FILE = directory/"blocklist.journal"
+        for name in args["--muters"].split(","):
+            muter = create_muter(name)
+            blockify = BenchBlockify(muter)
+            latencies, spawns = measure(blockify, directory/"calls.log", int(args["--events"]))
+            muter.close()
+            percentiles = statistics.quantiles(latencies, n=100)
+            print(f"{name:<16} p50 {percentiles[49] * 1000:8.2f} ms   p99 {percentiles[98] * 1000:8.2f} ms   "
+                  f"{statistics.mean(spawns):5.1f} processes/ad")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""pactl_parsing
+
+Times how long PulseMuter takes to parse and join the output of
+"pactl list clients" and "pactl list sink-inputs", in both the text and the
+JSON format. The outputs are captured-like, generated with the given sizes.
+
+Usage:
+    pactl_parsing.py [--clients=<n>] [--sinks=<n>] [--repeat=<n>]
+
+Options:
+    --clients=<n>  Number of pulse clients, 1 in 10 being spotify. [default: 200]
+    --sinks=<n>    Number of sink-inputs, spread over the clients. [default: 1000]
+    --repeat=<n>   Number of runs to average. [default: 50]
+"""
+import json
+import time
+
+from docopt import docopt
+
+from blockify.muters import PulseClient, PulseSink
+
+
+def client_binary(index):
+    return "spotify" if index % 10 == 0 else f"app{index}"
+
+
+def text_clients(n):
+    return "\n\n".join(
+        f"Client #{i}\n"
+        f"\tDriver: PipeWire\n"
+        f"\tOwner Module: n/a\n"
+        f"\tProperties:\n"
+        f"\t\tapplication.name = \"{client_binary(i)}\"\n"
+        f"\t\tapplication.process.id = \"{1000 + i}\"\n"
+        f"\t\tapplication.process.binary = \"{client_binary(i)}\"\n"
+        f"\t\tobject.serial = \"{i}\""
+        for i in range(n)
+    ) + "\n"
+
+
+def text_sinks(n, clients):
+    return "\n\n".join(
+        f"Sink Input #{1000 + i}\n"
+        f"\tDriver: PipeWire\n"
+        f"\tOwner Module: n/a\n"
+        f"\tClient: {i % clients}\n"
+        f"\tSink: 55\n"
+        f"\tSample Specification: float32le 2ch 48000Hz\n"
+        f"\tChannel Map: front-left,front-right\n"
+        f"\tFormat: pcm, format.sample_format = \"\\\"float32le\\\"\"\n"
+        f"\tCorked: no\n"
+        f"\tMute: no\n"
+        f"\tVolume: front-left: 65536 / 100% / 0.00 dB\n"
+        f"\tBuffer Latency: 0 usec\n"
+        f"\tResample method: PipeWire\n"
+        f"\tProperties:\n"
+        f"\t\tmedia.name = \"Playback\"\n"
+        f"\t\tapplication.process.binary = \"{client_binary(i % clients)}\""
+        for i in range(n)
+    ) + "\n"
+
+
+def json_clients(n):
+    return json.dumps([
+        {"index": i, "driver": "PipeWire", "owner_module": "n/a", "properties": {
+            "application.name": client_binary(i),
+            "application.process.id": str(1000 + i),
+            "application.process.binary": client_binary(i),
+            "object.serial": str(i),
+        }} for i in range(n)
+    ])
+
+
+def json_sinks(n, clients):
+    return json.dumps([
+        {"index": 1000 + i, "driver": "PipeWire", "owner_module": "n/a", "client": str(i % clients), "sink": 55,
+         "sample_specification": "float32le 2ch 48000Hz", "channel_map": "front-left,front-right",
+         "corked": False, "mute": False, "buffer_latency_usec": 0.0, "resample_method": "PipeWire",
+         "properties": {"media.name": "Playback", "application.process.binary": client_binary(i % clients)}}
+        for i in range(n)
+    ])
+
+
+def parse_text(clients_out, sinks_out):
+    clients = [PulseClient.from_text(block) for block in clients_out.split("\n\n") if block.strip()]
+    sinks = [PulseSink.from_text(block) for block in sinks_out.split("\n\n") if block.strip()]
+    return clients, sinks
+
+
+def parse_json(clients_out, sinks_out):
+    clients = [PulseClient.from_json(client) for client in json.loads(clients_out)]
+    sinks = [PulseSink.from_json(sink) for sink in json.loads(sinks_out)]
+    return clients, sinks
+
+
+def spotify_sinks(clients, sinks):
+    spotify_clients = {client.id for client in clients if client.is_spotify}
+    return [sink for sink in sinks if sink.client in spotify_clients]
+
+
+def bench(name, parse, clients_out, sinks_out, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        found = spotify_sinks(*parse(clients_out, sinks_out))
+    elapsed = (time.perf_counter() - start) / repeat
+    size = (len(clients_out) + len(sinks_out)) / 1024
+    print(f"{name:<5} {size:>9.1f} KiB {elapsed * 1000:>9.3f} ms/snapshot {len(found):>6} spotify sink-inputs")
+
+
+def main():
+    args = docopt(__doc__)
+    n_clients, n_sinks, repeat = int(args["--clients"]), int(args["--sinks"]), int(args["--repeat"])
+    bench("text", parse_text, text_clients(n_clients), text_sinks(n_sinks, n_clients), repeat)
+    bench("json", parse_json, json_clients(n_clients), json_sinks(n_sinks, n_clients), repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Stand-in for pactl, amixer, pw-dump and pw-cli, used by the benchmarks.
+
+mute_latency.py installs it on PATH under all of their names. Every call is logged,
+with the time it started, to calls.log in $BLOCKIFY_BENCH_DIR, and the
+canned outputs written there are printed back.
+"""
+import os
+import signal
+import sys
+import time
+
+started = time.time()
+directory = os.environ["BLOCKIFY_BENCH_DIR"]
+command = os.path.basename(sys.argv[0])
+args = sys.argv[1:]
+
+# amixer -s reads its commands from stdin.
+commands = sys.stdin.read().strip().replace("\n", "; ") if command == "amixer" and "-s" in args else ""
+with open(os.path.join(directory, "calls.log"), "a") as calls:
+    calls.write(f"{started} {command} {' '.join(args)} {commands}\n")
+
+
+def print_canned(name):
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        sys.exit(f"{command}: no canned output {name}")
+    with open(path) as f:
+        sys.stdout.write(f.read())
+
+
+if command == "pactl":
+    if args[:2] == ["-f", "json"]:
+        print_canned(f"pactl-{args[-1]}.json")
+    elif args[:1] == ["list"]:
+        print_canned(f"pactl-{args[-1]}.txt")
+    elif args == ["subscribe"]:
+        # No events: the initial state is all there is.
+        signal.pause()
+elif command == "amixer" and not args:
+    print_canned("amixer.txt")
+elif command == "pw-dump":
+    print_canned("pw-dump.json")
+    if "--monitor" in args:
+        sys.stdout.flush()
+        # No changes: the initial dump is all there is.
+        signal.pause()
@@ -1,2 +1,19 @@
-from .util import *
-from .cli import *
\ No newline at end of file
+import importlib
+
+
+def __getattr__(name):
+    # The names of util and cli are available from the package, but the modules are only imported
+    # on first use: importing e.g. blockify.blocklist must not load the whole CLI.
+    if name.startswith("_"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    try:
+        # "from blockify import util" looks the submodule up as an attribute first.
+        return importlib.import_module(f".{name}", __name__)
+    except ModuleNotFoundError as e:
+        if e.name != f"{__name__}.{name}":
+            raise
+    for module_name in ("cli", "util"):
+        module = importlib.import_module(f".{module_name}", __name__)
+        if hasattr(module, name):
+            return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,260 @@
+"""Spotify's DBus interface on an asyncio event loop, through jeepney.
+
+It needs neither dbus-python nor PyGObject. The properties of the player are
+mirrored locally and kept up to date by its PropertiesChanged signals, so that
+the getters don't wait for any round trip. Player methods are sent in the
+background, as soon as spotify is connected.
+"""
+import asyncio
+import logging
+import time
+
+from jeepney import DBusAddress, HeaderFields, MatchRule, Properties, new_method_call
+from jeepney.bus_messages import message_bus
+from jeepney.io.asyncio import DBusRouter, Proxy, open_dbus_connection
+from jeepney.wrappers import DBusErrorResponse, unwrap_msg
+
+from blockify import metrics, trace
+from blockify.mpris import EventCoalescer, MprisClient
+
+log = logging.getLogger("dbus")
+
+# Signatures used to send the values given to set_property().
+SIGNATURES = {bool: "b", int: "x", float: "d", str: "s"}
+
+
+def unwrap(variant):
+    """Gets the value out of a variant, as (signature, value) is how jeepney reads them."""
+    signature, value = variant
+    if signature == "a{sv}":
+        return {key: unwrap(item) for key, item in value.items()}
+    return value
+
+
+class SpotifyDBusClient(MprisClient):
+    """Wrapper for Spotify's DBus interface, running on an asyncio event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.obj_path = "/org/mpris/MediaPlayer2"
+        self.prop_path = "org.freedesktop.DBus.Properties"
+        self.player_path = "org.mpris.MediaPlayer2.Player"
+        self.spotify_path = "org.mpris.MediaPlayer2.spotify"
+        self.player = DBusAddress(self.obj_path, bus_name=self.spotify_path, interface=self.player_path)
+        self.router: DBusRouter | None = None
+        self.owner = ""                     # unique name of spotify on the bus, if running
+        self.connected = asyncio.Event()    # the player's properties were read
+        self.properties = {}                # player's properties, unwrapped
+        self.position_at = 0.0              # monotonic time at which properties["Position"] was current
+        self.property_handlers = []
+        self.seeked_handlers = []
+        self.connected_handlers = []
+        self.closed_handlers = []
+        self.tasks = set()
+
+    @property
+    def is_connected(self) -> bool:
+        return self.connected.is_set()
+
+    def connect(self) -> bool:
+        """Attaches to spotify if it is running, without waiting for it otherwise.
+
+        Any later instance of spotify is attached to as soon as it appears on the
+        bus. If the event loop is not running yet, it runs until the bus answers.
+        Returns whether spotify is connected.
+        """
+        if self.loop.is_running():
+            self._spawn(self._connect())
+        else:
+            self.loop.run_until_complete(self._connect())
+        return self.is_connected
+
+    async def _connect(self):
+        if self.router is None:
+            self.router = DBusRouter(await open_dbus_connection("SESSION"))
+            await self._subscribe()
+        log.info("Connecting to spotify...")
+        try:
+            owner, = await Proxy(message_bus, self.router).GetNameOwner(self.spotify_path)
+        except DBusErrorResponse:
+            log.info("Spotify is not running. Waiting for it to start.")
+            return
+        await self._attach(owner)
+
+    async def _attach(self, owner: str):
+        if owner == self.owner:
+            return
+        self.owner = owner
+        try:
+            properties, = await self._call(Properties(self.player).get_all())
+        except DBusErrorResponse as e:
+            # Closed again in the meantime: NameOwnerChanged reports it.
+            log.error(f"Failed connecting to spotify: {e}")
+            return
+        self.properties = {name: unwrap(value) for name, value in properties.items()}
+        self.position_at = time.monotonic()
+        self.connected.set()
+        if metrics.enabled:
+            metrics.inc("blockify_spotify_connections_total")
+        if trace.enabled:
+            trace.record(trace.Kind.CONNECTED)
+        log.info("Connection established!")
+        for fun in self.connected_handlers:
+            fun()
+
+    async def _subscribe(self):
+        signals = [
+            (self.spotify_path, self.prop_path, "PropertiesChanged", self.obj_path, self._on_properties_changed),
+            (self.spotify_path, self.player_path, "Seeked", self.obj_path, self._on_seeked),
+            ("org.freedesktop.DBus", "org.freedesktop.DBus", "NameOwnerChanged", "/org/freedesktop/DBus",
+             self._on_owner_changed),
+        ]
+        bus = Proxy(message_bus, self.router)
+        for sender, interface, member, path, handler in signals:
+            rule = MatchRule(type="signal", sender=sender, interface=interface, member=member, path=path)
+            if member == "NameOwnerChanged":
+                rule.add_arg_condition(0, self.spotify_path)
+            await bus.AddMatch(rule)
+            # Received messages carry the unique name of the sender, so they are matched without it.
+            local_rule = MatchRule(type="signal", interface=interface, member=member, path=path)
+            queue = asyncio.Queue()
+            self.router.filter(local_rule, queue=queue)
+            self._spawn(self._dispatch(queue, handler))
+
+    async def _dispatch(self, queue: asyncio.Queue, handler):
+        while True:
+            message = await queue.get()
+            try:
+                handler(*message.body)
+            except Exception as e:
+                log.error(f"Failed handling {handler.__name__}: {e}")
+
+    def _on_properties_changed(self, interface_name, changed_properties, invalidated_properties):
+        if interface_name != self.player_path:
+            return
+        changed_properties = {name: unwrap(value) for name, value in changed_properties.items()}
+        if "PlaybackStatus" in changed_properties:
+            # The position only moves while playing.
+            self.properties["Position"] = self.get_song_position()
+            self.position_at = time.monotonic()
+        current_track = self.properties.get("Metadata", {}).get("mpris:trackid")
+        if "Metadata" in changed_properties and changed_properties["Metadata"].get("mpris:trackid") != current_track:
+            self.properties["Position"] = 0
+            self.position_at = time.monotonic()
+        self.properties.update(changed_properties)
+        for fun in self.property_handlers:
+            fun(interface_name, changed_properties, invalidated_properties)
+
+    def _on_seeked(self, position):
+        self.properties["Position"] = position
+        self.position_at = time.monotonic()
+        for fun in self.seeked_handlers:
+            fun(position)
+
+    def _on_owner_changed(self, bus_name, old_owner, new_owner):
+        if new_owner:
+            self._spawn(self._attach(new_owner))
+            return
+        self.owner = ""
+        self.connected.clear()
+        if metrics.enabled:
+            metrics.inc("blockify_spotify_disconnections_total")
+        if trace.enabled:
+            trace.record(trace.Kind.CLOSED)
+        self.properties = {}
+        for fun in self.closed_handlers:
+            fun()
+
+    def _spawn(self, coroutine):
+        task = self.loop.create_task(coroutine)
+        # The loop keeps only weak references to its tasks.
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _call(self, message):
+        if not metrics.enabled:
+            return unwrap_msg(await self.router.send_and_get_reply(message))
+        with metrics.Timer("blockify_dbus_call_seconds", method=message.header.fields[HeaderFields.member]):
+            return unwrap_msg(await self.router.send_and_get_reply(message))
+
+    async def _call_player(self, method, signature=None, body=()):
+        await self.connected.wait()
+        try:
+            await self._call(new_method_call(self.player, method, signature, body))
+        except Exception as e:
+            log.error(f"Cannot {method}: {e}")
+
+    def on_property_change(self, fun):
+        self.property_handlers.append(fun)
+
+    def on_seeked(self, fun):
+        """Calls fun with the new position (in microseconds) whenever the playback jumps."""
+        self.seeked_handlers.append(fun)
+
+    def on_connected(self, fun):
+        """Calls fun every time spotify appears on the bus and the client attaches to it."""
+        self.connected_handlers.append(fun)
+
+    def on_closed(self, fun):
+        """Calls fun when spotify leaves the bus, e.g. because it was closed."""
+        self.closed_handlers.append(fun)
+
+    def on_metadata_and_playback_change(self, fun, coalescer: EventCoalescer | None = None):
+        def _playback_status_changed(interface_name, changed_properties, invalidated_properties):
+            if "Metadata" not in changed_properties and "PlaybackStatus" not in changed_properties:
+                return
+            self._metadata_or_playback_changed(changed_properties, fun, coalescer)
+        self.on_property_change(_playback_status_changed)
+
+    def get_property(self, key):
+        """Gets the value from any available property."""
+        prop = self.properties.get(key)
+        if prop is None:
+            log.error(f"Failed to get DBus property: {key} is unknown.")
+        return prop
+
+    def set_property(self, key, value):
+        """Sets the value for any available property."""
+        message = Properties(self.player).set(key, SIGNATURES[type(value)], value)
+        self._spawn(self._call(message))
+
+    def get_song_position(self):
+        """Gets the playback position in the current song (in microseconds)."""
+        position = self.properties.get("Position", 0)
+        if self.properties.get("PlaybackStatus") == "Playing":
+            position += int((time.monotonic() - self.position_at) * 1_000_000)
+        return position
+
+    def playpause(self):
+        """Toggles the current song between Play and Pause."""
+        self._spawn(self._call_player("PlayPause"))
+
+    def play(self):
+        """Tries to play the current title."""
+        self._spawn(self._call_player("Play"))
+
+    def pause(self):
+        """Tries to pause the current title."""
+        self._spawn(self._call_player("Pause"))
+
+    def stop(self):
+        """Tries to stop playback. PlayPause is probably preferable."""
+        self._spawn(self._call_player("Stop"))
+
+    def next(self):
+        """Tries to skip to next song."""
+        self._spawn(self._call_player("Next"))
+
+    def prev(self):
+        """Tries to go back to last song."""
+        self._spawn(self._call_player("Previous"))
+
+    def set_position(self, track, position):
+        self._spawn(self._call_player("SetPosition", "ox", (track, position)))
+
+    def open_uri(self, uri):
+        self._spawn(self._call_player("OpenUri", "s", (uri,)))
+
+    def seek(self, seconds):
+        """Skips n seconds forward."""
+        self._spawn(self._call_player("Seek", "x", (seconds,)))
@@ -1,22 +1,96 @@
 import codecs
 import logging
 import os
+import sys
 
 from blockify import util
+from blockify.matchers import PatternMatcher, PrefixMatcher, SubstringMatcher
 
 log = logging.getLogger("list")
 
 
-class Blocklist(list):
+class BlocklistFile():
+    """Access to blocklist.txt shared by all the blocklist storages."""
+
+    def watch(self) -> bool:
+        """Reloads the blocklist as soon as its file changes, instead of checking it on every lookup."""
+        if getattr(self, "monitor", None) is not None:
+            # Already watched, e.g. for another player.
+            return True
+        try:
+            from gi.repository import Gio
+            self.monitor = Gio.File.new_for_path(str(self.location)).monitor_file(Gio.FileMonitorFlags.NONE, None)
+        except Exception as e:
+            log.warning(f"Cannot watch {self.location}: {e}. Falling back to checking its timestamp.")
+            return False
+        self.monitor.connect("changed", self._on_file_changed)
+        log.info(f"Watching {self.location} for changes.")
+        return True
+
+    def _on_file_changed(self, monitor, file, other_file, event_type):
+        from gi.repository import Gio
+        if event_type in (Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+                          Gio.FileMonitorEvent.CREATED,
+                          Gio.FileMonitorEvent.DELETED):
+            self.reload_if_changed()
+
+    def reload_if_changed(self) -> bool:
+        try:
+            current_timestamp = self.get_timestamp()
+        except OSError as e:
+            log.debug(f"Failed reading blocklist timestamp: {e}. Recovering.")
+            current_timestamp = None
+        if self.timestamp == current_timestamp:
+            return False
+        log.warning("Blockfile changed. Reloading.")
+        self.reload()
+        return True
+
+    def get_timestamp(self) -> float:
+        return self.location.stat().st_mtime
+
+    def read_file(self):
+        try:
+            with codecs.open(self.location, "r", encoding="utf-8") as f:
+                blocklist = f.read()
+        except IOError:
+            with codecs.open(self.location, "w+", encoding="utf-8") as f:
+                blocklist = f.read()
+            log.warning("No blockfile found. Created one.")
+
+        return [i for i in blocklist.split("\n") if i]
+
+    def write_file(self, items):
+        """Atomically rewrites blocklist.txt, so that a crash can't leave it truncated."""
+        log.debug(f"Saving blocklist to {self.location}.")
+        tmp_location = self.location.with_name(self.location.name + ".tmp")
+        with codecs.open(tmp_location, "w", encoding="utf-8") as f:
+            for item in items:
+                f.write(item + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_location, self.location)
+        self.timestamp = self.get_timestamp()
+
+
+class Blocklist(BlocklistFile, list):
     """List extended to store (manually) blocked songs/ads persisently."""
     # Could subclass UserList.UserList here instead which inherits from
     # collections.MutableSequence. In Python3 it's collections.UserList.
 
+    # Number of journal records after which they are compacted into the blocklist file.
+    compact_after = 100
+
     def __init__(self):
         super(Blocklist, self).__init__()
         self.location = util.BLOCKLIST_FILE
+        self.journal_location = util.BLOCKLIST_JOURNAL_FILE
         self.use_substring_search = util.CONFIG["general"]["substring_search"]
+        self.use_journal = util.CONFIG["general"]["blocklist_journal"]
+        self.journal_records = 0
+        self.revision = 0   # incremented on every change, to invalidate what depends on the content
         self.extend(self.load())
+        self.matcher = self._build_matcher()
         log.info(f"Blocklist loaded from {self.location}.")
         self.timestamp = self.get_timestamp()
 
@@ -28,45 +102,241 @@ class Blocklist(list):
             return
         log.debug(f"Adding {item} to {self.location}.")
         super(Blocklist, self).append(item)
-        self.save()
+        self.matcher.add(item)
+        self.revision += 1
+        self.persist("+", item)
 
     def remove(self, item):
         log.debug(f"Removing {item} from {self.location}.")
         try:
             super(Blocklist, self).remove(item)
-            self.save()
+            if item in self:
+                # A later duplicate took its place: rebuild to keep list order.
+                self.matcher = self._build_matcher()
+            else:
+                self.matcher.discard(item)
+            self.revision += 1
+            self.persist("-", item)
         except ValueError as e:
             log.error(f"Could not remove {item} from blocklist: {e}")
 
     def find(self, song):
-        if self.use_substring_search:
-            for item in self:
-                if item in song:
-                    return item
-        else:
-            # Arbitrary minimum length of 4 to avoid ambiguous song names.
-            while len(song) > 4:
-                for item in self:
-                    if item.startswith(song):
-                        return item
-                song = song[:int(len(song) / 2)]
+        return self.matcher.find(song)
 
-    def get_timestamp(self) -> float:
-        return self.location.stat().st_mtime
+    def _build_matcher(self):
+        literal_matcher_class = SubstringMatcher if self.use_substring_search else PrefixMatcher
+        return PatternMatcher(literal_matcher_class, self)
+
+    def reload(self):
+        """Applies only the lines added to or removed from the file since it was last read."""
+        lines = self.load()
+        removed = set(self).difference(lines)
+        if removed:
+            self[:] = [item for item in self if item not in removed]
+            for item in removed:
+                self.matcher.discard(item)
+        present = set(self)
+        added = []
+        for item in lines:
+            if item not in present:
+                present.add(item)
+                added.append(item)
+        self.extend(added)
+        for item in added:
+            self.matcher.add(item)
+        if added or removed:
+            self.revision += 1
+        self.timestamp = self.get_timestamp()
+        log.info(f"Blocklist reloaded: {len(added)} added, {len(removed)} removed.")
 
     def load(self):
+        items = self.read_file()
+        if self.use_journal:
+            items = self.replay_journal(items)
+        return items
+
+    def replay_journal(self, items):
+        """Applies the records not yet compacted into the blocklist file."""
         try:
-            with codecs.open(self.location, "r", encoding="utf-8") as f:
-                blocklist = f.read()
+            with codecs.open(self.journal_location, "r", encoding="utf-8") as f:
+                records = [r for r in f.read().split("\n") if r]
         except IOError:
-            with codecs.open(self.location, "w+", encoding="utf-8") as f:
-                blocklist = f.read()
-            log.warning("No blockfile found. Created one.")
+            records = []
+        for record in records:
+            op, item = record[0], record[1:]
+            if op == "+" and item not in items:
+                items.append(item)
+            elif op == "-" and item in items:
+                items.remove(item)
+        self.journal_records = len(records)
+        if records:
+            log.info(f"Replayed {len(records)} records from {self.journal_location}.")
+        return items
 
-        return [i for i in blocklist.split("\n") if i]
+    def persist(self, op, item):
+        """Records a single addition ("+") or removal ("-") of an item."""
+        if not self.use_journal:
+            self.save()
+            return
+        with codecs.open(self.journal_location, "a", encoding="utf-8") as f:
+            f.write(f"{op}{item}\n")
+        self.journal_records += 1
+        if self.journal_records >= self.compact_after:
+            self.save()
 
     def save(self):
-        log.debug(f"Saving blocklist to {self.location}.")
-        with codecs.open(self.location, "w", encoding="utf-8") as f:
-            f.write("\n".join(self) + "\n")
-        self.timestamp = self.get_timestamp()
+        """Atomically rewrites the blocklist file, compacting the journal into it."""
+        self.write_file(self)
+        if self.journal_records:
+            self.journal_location.unlink(missing_ok=True)
+            self.journal_records = 0
+
+    def close(self):
+        if self.journal_records:
+            self.save()
+
+
+class SQLiteBlocklist(BlocklistFile):
+    """Blocklist stored in an SQLite database, for lists too large to be kept in memory.
+
+    The database is the source of truth: the lines added to or removed from
+    blocklist.txt since it was last imported or exported are applied when it changes,
+    and it is exported back on exit, so it stays in the usual format. With
+    substring_search, all the entries are kept in memory too, as substrings can't be
+    looked up in the database's index.
+    """
+
+    def __init__(self):
+        self.location = util.BLOCKLIST_FILE
+        self.db_location = util.BLOCKLIST_DB_FILE
+        self.use_substring_search = util.CONFIG["general"]["substring_search"]
+        self.changed = False
+        self.revision = 0   # incremented on every change, to invalidate what depends on the content
+        import sqlite3
+        self.db = sqlite3.connect(self.db_location)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS blocklist ("
+                            "rank INTEGER PRIMARY KEY AUTOINCREMENT, entry TEXT NOT NULL UNIQUE)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+            # blocklist.txt as it was last imported or exported, to find what was edited in it since.
+            self.db.execute("CREATE TABLE IF NOT EXISTS file_entries (entry TEXT PRIMARY KEY)")
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'timestamp'").fetchone()
+        self.timestamp = row[0] if row else None
+        if not self.location.exists():
+            self.save()
+        # Imports blocklist.txt if it was edited while blockify wasn't running.
+        if not self.reload_if_changed():
+            self.patterns = self._build_matcher()
+        log.info(f"Blocklist loaded from {self.db_location}.")
+
+    def __len__(self):
+        return self.db.execute("SELECT count(*) FROM blocklist").fetchone()[0]
+
+    def __contains__(self, item):
+        return self.db.execute("SELECT 1 FROM blocklist WHERE entry = ?", (item,)).fetchone() is not None
+
+    def __iter__(self):
+        return (row[0] for row in self.db.execute("SELECT entry FROM blocklist ORDER BY rank"))
+
+    def append(self, item):
+        # Only allow nonempty strings.
+        if not item or item == " ":
+            log.debug(f"Not adding empty item: {item}.")
+            return
+        with self.db:
+            added = self.db.execute("INSERT OR IGNORE INTO blocklist (entry) VALUES (?)", (item,)).rowcount
+        if not added:
+            log.debug(f"Not adding duplicate item: {item}.")
+            return
+        log.debug(f"Added {item} to {self.db_location}.")
+        self.patterns.add(item)
+        self.revision += 1
+        self.changed = True
+
+    def remove(self, item):
+        with self.db:
+            removed = self.db.execute("DELETE FROM blocklist WHERE entry = ?", (item,)).rowcount
+        if not removed:
+            log.error(f"Could not remove {item} from blocklist: not found.")
+            return
+        log.debug(f"Removed {item} from {self.db_location}.")
+        self.patterns.discard(item)
+        self.revision += 1
+        self.changed = True
+
+    def find(self, song):
+        if not self.use_substring_search:
+            prefix = song
+            # Arbitrary minimum length of 4 to avoid ambiguous song names.
+            while len(prefix) > 4:
+                # Range query on the entries' index: all the entries starting with prefix.
+                row = self.db.execute("SELECT entry FROM blocklist WHERE entry >= ? AND entry < ? "
+                                      "ORDER BY rank LIMIT 1", (prefix, upper_bound(prefix))).fetchone()
+                if row:
+                    return row[0]
+                prefix = prefix[:len(prefix) // 2]
+        return self.patterns.find(song)
+
+    def _build_matcher(self):
+        if self.use_substring_search:
+            return PatternMatcher(SubstringMatcher, iter(self))
+        return PatternMatcher(PrefixMatcher, self._select_patterns())
+
+    def _select_patterns(self):
+        # "glob;" and "re;" are the smallest strings greater than all those starting with "glob:" and "re:".
+        rows = self.db.execute("SELECT entry FROM blocklist WHERE (entry >= 'glob:' AND entry < 'glob;') "
+                               "OR (entry >= 're:' AND entry < 're;') ORDER BY rank")
+        return [row[0] for row in rows]
+
+    def reload(self):
+        """Imports the lines added to or removed from blocklist.txt since it was last imported or exported.
+
+        The entries added or removed at runtime, not exported yet, are kept as they are.
+        """
+        lines = self.read_file()
+        with self.db:
+            self.db.execute("CREATE TEMP TABLE IF NOT EXISTS new_file_entries (entry TEXT PRIMARY KEY)")
+            self.db.execute("DELETE FROM new_file_entries")
+            self.db.executemany("INSERT OR IGNORE INTO new_file_entries VALUES (?)", ((line,) for line in lines))
+            removed = self.db.execute("DELETE FROM blocklist WHERE entry IN (SELECT entry FROM file_entries "
+                                      "WHERE entry NOT IN (SELECT entry FROM new_file_entries))").rowcount
+            added = self.db.execute("INSERT OR IGNORE INTO blocklist (entry) SELECT entry FROM new_file_entries "
+                                    "WHERE entry NOT IN (SELECT entry FROM file_entries) ORDER BY rowid").rowcount
+            self.db.execute("DELETE FROM file_entries")
+            self.db.execute("INSERT INTO file_entries SELECT entry FROM new_file_entries")
+            self.timestamp = self.get_timestamp()
+            self.db.execute("REPLACE INTO meta VALUES ('timestamp', ?)", (self.timestamp,))
+        self.patterns = self._build_matcher()
+        if added or removed:
+            self.revision += 1
+        log.info(f"Blocklist imported from {self.location}: {added} added, {removed} removed.")
+
+    def save(self):
+        """Exports the database to blocklist.txt."""
+        self.write_file(iter(self))
+        with self.db:
+            self.db.execute("DELETE FROM file_entries")
+            self.db.execute("INSERT INTO file_entries SELECT entry FROM blocklist")
+            self.db.execute("REPLACE INTO meta VALUES ('timestamp', ?)", (self.timestamp,))
+        self.changed = False
+
+    def close(self):
+        if self.changed:
+            self.save()
+        self.db.close()
+
+
+def upper_bound(prefix: str) -> str:
+    """Returns the smallest string greater than all the strings starting with prefix."""
+    last = ord(prefix[-1])
+    if last == sys.maxunicode:
+        return prefix + chr(last)
+    # Skips the surrogates, which can't be encoded in the database.
+    last = 0xE000 if last == 0xD7FF else last + 1
+    return prefix[:-1] + chr(last)
+
+
+def load_blocklist():
+    if util.CONFIG["general"]["blocklist_storage"] == "sqlite":
+        return SQLiteBlocklist()
+    return Blocklist()
@@ -11,63 +11,161 @@ Options:
     -h, --help        Show this help text.
     --version         Show current version of blockify.
 """
+import importlib.util
 import logging
 import signal
 import sys
+import time
 
-import gi
-gi.require_version("Gtk", "4.0")
-from gi.repository import GLib
+from collections import OrderedDict
 
 from enum import Enum
 
-from blockify import blocklist, dbusclient, util
-from blockify.muters import AlsaMuter, PulseMuter, SystemCommandNotFound
+from blockify import blocklist, metrics, trace, util
+from blockify.mainloops import AsyncioMainLoop, GLibMainLoop
+from blockify.mpris import EventCoalescer
+from blockify.muters import AlsaMuter, PipeWireMuter, PulseMuter, SystemCommandNotFound
 
 log = logging.getLogger("cli")
 
+MUTERS = ("auto", "pipewire", "pulse", "alsa")
+
+class DecisionCache(object):
+    """Bounded LRU cache of the blocking decisions taken for each track, by the key from get_track_key()."""
+    def __init__(self, size: int):
+        self.size = size
+        self.decisions: OrderedDict[str, tuple[str, bool]] = OrderedDict()
+        self.revision = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, track_key: str, revision: int) -> tuple[str, bool] | None:
+        if revision != self.revision:
+            # The blocklist changed since the decisions were taken.
+            self.decisions.clear()
+            self.revision = revision
+        decision = self.decisions.get(track_key) if track_key else None
+        if decision is None:
+            self.misses += 1
+            return None
+        self.decisions.move_to_end(track_key)
+        self.hits += 1
+        return decision
+
+    def put(self, track_key: str, decision: tuple[str, bool]):
+        if not track_key or self.size <= 0:
+            return
+        self.decisions[track_key] = decision
+        self.decisions.move_to_end(track_key)
+        if len(self.decisions) > self.size:
+            self.decisions.popitem(last=False)
+
 class Blockify(object):
-    def __init__(self, blocklist: blocklist.Blocklist):
+    def __init__(self, blocklist: blocklist.Blocklist | blocklist.SQLiteBlocklist):
         self.blocklist = blocklist
-        self.orglist = blocklist[:]
 
         self.autoplay = util.CONFIG["general"]["autoplay"]
+        self.dbus_backend = self.choose_dbus_backend()
+        self.main_loop = self.create_main_loop()
+        self.watching_blocklist = (util.CONFIG["general"]["watch_blocklist"] and self.main_loop.watches_files
+                                   and self.blocklist.watch())
         self.unmute_delay = util.CONFIG["cli"]["unmute_delay"]
+        self.decisions = DecisionCache(util.CONFIG["cli"]["decision_cache_size"])
+        self.premute_ahead = util.CONFIG["cli"]["premute_ahead"]
+        self.premute_timer = None
+        self.premuted_at = None     # monotonic time of the last pre-mute, until the song changes
+        self.current_length = 0     # in microseconds
         self.blocking = False   # used by unmute_with_delay() to check if, in the meantime, no ad was found
                                 # it must be changed after having called mute()/umute()
         self.current_song = ""
+        self.traced_track_id = ""   # of the current song, kept only while tracing
+        self.started = False
+        self.signal_matches = []    # of the spotify client, when it returns them
+        self.control = None
+        self.early_decision = None  # (metadata, blocklist revision, decision) taken by is_urgent()
+
+        self.muter = self.choose_muter()
+        self.coalescer = EventCoalescer(util.CONFIG["cli"]["coalesce_window"], self.main_loop, urgent=self.is_urgent,
+                                        # e.g. the same song played again, after being pre-muted
+                                        dropped=lambda metadata: self.undo_premute())
+        self.spotify = self.connect_to_spotify()
+        log.info("Blockify initialized.")
 
-        try:
-            self.muter = PulseMuter()
+    def choose_dbus_backend(self) -> str:
+        backend = util.CONFIG["cli"]["dbus_backend"]
+        if (backend != "jeepney" and importlib.util.find_spec("jeepney") is not None
+                and (importlib.util.find_spec("dbus") is None or importlib.util.find_spec("gi") is None)):
+            # Installed with the jeepney extra only.
+            log.warning("dbus-python or PyGObject is not installed. Using the jeepney DBus backend.")
+            return "jeepney"
+        return backend
+
+    def create_main_loop(self):
+        if self.dbus_backend == "jeepney":
+            log.info("DBus backend is jeepney, on an asyncio event loop.")
+            return AsyncioMainLoop()
+        return GLibMainLoop()
+
+    def choose_muter(self):
+        method = util.CONFIG["cli"]["muter"]
+        if method not in MUTERS:
+            log.error(f"Unknown muter {method}, expected one of: {', '.join(MUTERS)}. Choosing it automatically.")
+            method = "auto"
+        pulse = None
+        if method != "alsa":
+            try:
+                pulse = PulseMuter(subscribe=util.CONFIG["cli"]["pulse_subscribe"])
+            except SystemCommandNotFound as e:
+                log.warning(f"No command '{e.command}' found. Spotify can't be muted through pulse.")
+        if method == "pipewire" or (method == "auto" and PipeWireMuter.is_running()):
+            try:
+                # Spotify's audio may still go through pulse, e.g. if PipeWire's pulse server isn't used.
+                muter = PipeWireMuter(fallback=pulse)
+                log.info("Mute method is PipeWire stream node" + (", or pulse sink without one." if pulse else "."))
+                return muter
+            except SystemCommandNotFound as e:
+                log.warning(f"No command '{e.command}' found. Falling back to pulse sink.")
+        if pulse is not None:
             log.info("Mute method is pulse sink.")
+            return pulse
+        if method != "alsa":
+            log.warning("Falling back to system mute via ALSA.")
+        try:
+            muter = AlsaMuter()
         except SystemCommandNotFound as e:
-            log.warning(f"No command '{e.command}' found. Falling back to system mute via ALSA.") #/pulse
-            try:
-                self.muter = AlsaMuter()
-            except SystemCommandNotFound as e2:
-                log.error(f"No command '{e2.command}' found. Exiting.")
-                exit(1)
-        self.main_loop = GLib.MainLoop()
-        self.spotify = self.connect_to_spotify()
-        log.info("Blockify initialized.")
+            log.error(f"No command '{e.command}' found. Exiting.")
+            exit(1)
+        return muter
 
     def mute(self):
         log.debug(f"mute(): blocking={self.blocking} muter={self.muter.is_muted}")
         if self.blocking and self.muter.is_muted:
+            if trace.enabled:
+                trace.record(trace.Kind.MUTE, self.traced_track_id, action=trace.Action.SKIPPED)
             return
+        started = time.monotonic() if trace.enabled else None
         self.muter.update()
         log.debug(f"Muting {self.muter.__class__.__name__}: {self.current_song}.")
         self.muter.mute()
+        if started is not None:
+            trace.record(trace.Kind.MUTE, self.traced_track_id, action=trace.Action.MUTE,
+                         duration=time.monotonic() - started)
 
     def unmute(self):
         log.debug(f"unmute(): blocking={self.blocking} muter={self.muter.is_muted}")
         if not self.blocking and not self.muter.is_muted:
             # if it's not blocking (i.e. ad or blocklist) but it's still muted (it was toggled),
             # we force the unmute
+            if trace.enabled:
+                trace.record(trace.Kind.UNMUTE, self.traced_track_id, action=trace.Action.SKIPPED)
             return
+        started = time.monotonic() if trace.enabled else None
         self.muter.update()
         log.debug(f"Unmuting {self.muter.__class__.__name__}.")
         self.muter.unmute()
+        if started is not None:
+            trace.record(trace.Kind.UNMUTE, self.traced_track_id, action=trace.Action.UNMUTE,
+                         duration=time.monotonic() - started)
 
     def toggle(self):
         """Mute/unmute the current song."""
@@ -81,94 +179,201 @@ class Blockify(object):
             self.muter.mute()
 
     def connect_to_spotify(self):
-        self.spotify = dbusclient.SpotifyDBusClient()
-        if self.establish_spotify_connection(): # blocking call
-            self.reconnect_if_closed(self.spotify.get_xdg_dbus())
+        if self.dbus_backend == "jeepney":
+            from blockify import aiodbusclient
+            self.spotify = aiodbusclient.SpotifyDBusClient(self.main_loop.loop)
+        else:
+            from blockify import dbusclient
+            self.spotify = dbusclient.SpotifyDBusClient()
+        self.spotify.on_closed(lambda: log.warning("Lost connection to spotify."))
+        self.spotify.on_connected(self.spotify_connected)
+        # Doesn't wait for spotify: it's attached to as soon as it starts, with the main loop running.
+        self.spotify.connect()
         return self.spotify
 
-    def establish_spotify_connection(self):
-        try:
-            self.spotify.connect()
-        except KeyboardInterrupt as e:
-            self.stop()
-            return False
-        except SystemExit:
-            # self.stop() was already called on another thread
-            return False
-        return True
-
-    def reconnect_if_closed(self, xdg_bus):
-            def reconnect(bus_name, old_owner, new_owner):
-                log.warning("Lost connection to spotify.")
-                if self.establish_spotify_connection():
-                    self.start_autoplay()
-            xdg_bus.connect_to_signal(
-                signal_name="NameOwnerChanged",
-                handler_function=reconnect,
-                dbus_interface="org.freedesktop.DBus",
-                arg0="org.mpris.MediaPlayer2.spotify",
-                arg2="",  # new_owner
-            )
+    def spotify_connected(self):
+        if not self.started:
+            # start() does the first check.
+            return
+        self.check_spotify()
+        self.start_autoplay()
 
     def start(self):
-        def check_spotify_on_change(metadata):
-            # NOTE: if autoplay is active and spotify was restarted, then this is executed twice in a row.
-            log.debug("Spotify changed status or playback: "+self.spotify.get_song())
-            self.check_spotify(metadata)
-
         self.bind_signals()
+        self.control = self.open_control()
+        self.start_metrics()
         # Force unmute to properly initialize unmuted state
 
-        self.check_spotify() # don't wait for a metadata change to check for ads for the first time
-        self.spotify.on_metadata_and_playback_change(check_spotify_on_change)
+        self.follow_spotify()
+        log.info("Blockify started.")
+        self.main_loop.run()
+
+    def follow_spotify(self):
+        """Checks the current song, then every change of song or playback."""
+        def check_spotify_on_change(metadata):
+            # NOTE: if autoplay is active and spotify was restarted, this can be called twice in a row for
+            # the same song: the coalescer drops the second call unless the status changed in between.
+            log.debug(f"Spotify changed status or playback: {self.spotify.get_song(metadata)}")
+            self.check_spotify(metadata)
+
+        self.started = True
+        if self.spotify.is_connected:
+            self.check_spotify() # don't wait for a metadata change to check for ads for the first time
+        self.signal_matches.append(self.spotify.on_metadata_and_playback_change(check_spotify_on_change, self.coalescer))
+        if self.premute_ahead:
+            self.signal_matches.append(self.spotify.on_seeked(self.seeked))
 
         if self.autoplay:
-            GLib.timeout_add(100, self.start_autoplay)
+            self.main_loop.timeout_add(100, self.start_autoplay)
             pass
 
-        log.info("Blockify started.")
-        self.main_loop.run()
-
     def start_autoplay(self):
-        if self.autoplay:
+        if self.autoplay and self.spotify.is_connected:
             log.info("Starting Spotify autoplayback.")
             self.spotify.play()
 
+    def seeked(self, position):
+        if trace.enabled:
+            trace.record(trace.Kind.SEEKED, self.traced_track_id)
+        self.undo_premute(int(position))
+        self.schedule_premute(int(position))
+
     def check_spotify(self, changed_metadata=None):
         """Checks for ads and mutes accordingly."""
         # is the only function who modifies self.blocking
-        artist = self.spotify.get_song_artist(changed_metadata)
-        title = self.spotify.get_song_title(changed_metadata)
-        self.current_song = f"{artist} - {title}"
-        in_blocklist = self.find_in_blocklist(self.current_song)
-        if in_blocklist or self.is_ad(artist, title, self.spotify.get_spotify_url(changed_metadata)):
+        started = time.monotonic() if trace.enabled else None
+        if self.premuted_at is not None:
+            log.info(f"Pre-muted {(time.monotonic() - self.premuted_at) * 1000:.0f} ms before the song changed.")
+            self.premuted_at = None
+        if not self.watching_blocklist:
+            # Check if the blockfile has changed.
+            self.blocklist.reload_if_changed()
+        early_decision, self.early_decision = self.early_decision, None
+        if (early_decision is not None and changed_metadata is not None and early_decision[0] is changed_metadata
+                and early_decision[1] == self.blocklist.revision):
+            self.current_song, block = early_decision[2]
+        else:
+            self.current_song, block = self.decide(changed_metadata)
+        if started is not None:
+            self.traced_track_id = self.spotify.get_track_id(changed_metadata)
+        if block:
             # GLib.timeout_add(1500, self.mute)
+            self.cancel_premute()
             self.mute()
+            if metrics.enabled and changed_metadata is not None:
+                self.observe_mute_latency()
             self.blocking = True
+            if started is not None:
+                trace.record(trace.Kind.CHECK, self.traced_track_id, trace.Decision.BLOCK, trace.Action.MUTE,
+                             time.monotonic() - started)
             return
         # Unmute with a certain delay to avoid the last second
         # of commercial you sometimes hear because it's unmuted too early.
-        GLib.timeout_add(self.unmute_delay, self.unmute_with_delay)
+        self.main_loop.timeout_add(self.unmute_delay, self.unmute_with_delay)
+        if self.premute_ahead:
+            self.current_length = self.spotify.get_song_length_us(changed_metadata)
+            self.schedule_premute()
+        if started is not None:
+            trace.record(trace.Kind.CHECK, self.traced_track_id, trace.Decision.PLAY,
+                         duration=time.monotonic() - started)
         return
 
+    def is_urgent(self, metadata) -> bool:
+        """Tells the coalescer whether the track is to be blocked: an ad can't wait for the end of a burst of events.
+
+        The decision is kept for check_spotify(), which gets the same metadata next.
+        """
+        decision = self.decide(metadata)
+        self.early_decision = (metadata, self.blocklist.revision, decision)
+        return decision[1]
+
+    def decide(self, metadata=None) -> tuple[str, bool]:
+        """Returns the song and whether it has to be blocked, reusing the decision taken for the same track."""
+        started = time.monotonic() if metrics.enabled else None
+        track_key = self.spotify.get_track_key(metadata)
+        decision = self.decisions.get(track_key, self.blocklist.revision)
+        if decision is None:
+            artist = self.spotify.get_song_artist(metadata)
+            title = self.spotify.get_song_title(metadata)
+            song = f"{artist} - {title}"
+            in_blocklist = self.find_in_blocklist(song)
+            ad = not in_blocklist and self.is_ad(artist, title, self.spotify.get_spotify_url(metadata))
+            decision = (song, in_blocklist or ad)
+            self.decisions.put(track_key, decision)
+            if started is not None and decision[1]:
+                metrics.inc("blockify_blocklist_hits_total" if in_blocklist else "blockify_ads_detected_total")
+        else:
+            log.debug(f"Reusing the decision taken for {track_key}.")
+        if started is not None:
+            metrics.observe("blockify_decision_seconds", time.monotonic() - started)
+        return decision
+
+    def observe_mute_latency(self):
+        """Observes the time from the player's event to the end of the mute it caused."""
+        event_at, self.spotify.event_at = self.spotify.event_at, None
+        if event_at is not None:
+            metrics.observe("blockify_event_to_mute_seconds", time.monotonic() - event_at,
+                            muter=self.muter.__class__.__name__)
+
+    def schedule_premute(self, position=None):
+        """Arms a timer that mutes just before the current song ends, in case an ad follows it."""
+        self.cancel_premute()
+        if not self.current_length:
+            return
+        if position is None:
+            position = self.spotify.get_song_position()
+        delay = (self.current_length - position) // 1000 - self.premute_ahead
+        if delay > 0:
+            self.premute_timer = self.main_loop.timeout_add(delay, self.premute)
+
+    def cancel_premute(self):
+        if self.premute_timer is not None:
+            self.main_loop.source_remove(self.premute_timer)
+            self.premute_timer = None
+
+    def premute(self):
+        self.premute_timer = None
+        if self.spotify.get_song_status() != "Playing":
+            # check_spotify() will schedule it again once the playback resumes.
+            return False
+        position = self.spotify.get_song_position()
+        if (self.current_length - position) // 1000 > 2 * self.premute_ahead:
+            # The playback was paused or went back in the meantime.
+            self.schedule_premute(position)
+            return False
+        log.debug(f"Pre-muting {self.muter.__class__.__name__} before the end of: {self.current_song}.")
+        started = time.monotonic()
+        self.muter.update()
+        self.muter.mute()
+        self.premuted_at = time.monotonic()
+        if trace.enabled:
+            trace.record(trace.Kind.PREMUTE, self.traced_track_id, action=trace.Action.MUTE,
+                         duration=self.premuted_at - started)
+        return False
+
+    def undo_premute(self, position=None):
+        """Unmutes after a pre-mute if the song went back, instead of ending, as no check would unmute it."""
+        if self.premuted_at is None or self.blocking:
+            return
+        if position is None:
+            position = self.spotify.get_song_position()
+        if (self.current_length - position) // 1000 <= 2 * self.premute_ahead:
+            # Still about to end.
+            return
+        log.info("The song went back after being pre-muted. Unmuting.")
+        self.premuted_at = None
+        self.unmute()
+
     def find_in_blocklist(self, song: str):
-        # Check if the blockfile has changed.
-        try:
-            current_timestamp = self.blocklist.get_timestamp()
-        except OSError as e:
-            log.debug(f"Failed reading blocklist timestamp: {e}. Recovering.")
-            self.blocklist.__init__()
-            current_timestamp = self.blocklist.timestamp
-        if self.blocklist.timestamp != current_timestamp:
-            log.warning("Blockfile changed. Reloading.")
-            self.blocklist.__init__()
-
-        if self.blocklist.find(song):
-            log.debug(f"Current song found in blocklist: {song}")
+        entry = self.blocklist.find(song)
+        if entry:
+            log.debug(f"Current song found in blocklist: {song} (entry: {entry})")
             return True
         return False
 
     def unmute_with_delay(self):
+        if trace.enabled:
+            trace.record(trace.Kind.UNMUTE_TIMER, self.traced_track_id)
         self.unmute()
         self.blocking = False
 
@@ -187,22 +392,59 @@ class Blockify(object):
         self.blocklist.append(self.current_song)
         self.check_spotify()
 
-    def unblock_current(self):
+    def unblock_current(self) -> bool:
         song = self.blocklist.find(self.current_song)
         if song:
             self.blocklist.remove(song)
             self.check_spotify()
+            return True
         else:
             log.error("Not found in blocklist or block pattern too short.")
+            return False
+
+    def reload(self):
+        """Reads the blocklist again and checks the current song against it."""
+        self.blocklist.reload()
+        if self.spotify.is_connected:
+            self.check_spotify()
+
+    def status(self) -> dict:
+        return {
+            "song": self.current_song,
+            "connected": self.spotify.is_connected,
+            "blocking": self.blocking,
+            "muted": self.muter.is_muted,
+        }
+
+    def start_metrics(self):
+        if metrics.enabled:
+            self.main_loop.timeout_add(util.CONFIG["cli"]["metrics_interval"] * 1000, self.write_metrics)
+
+    def write_metrics(self) -> bool:
+        metrics.write(util.CONFIG["cli"]["metrics_file"])
+        return True
+
+    def open_control(self):
+        if not util.CONFIG["cli"]["control_socket"]:
+            return None
+        from blockify.control import ControlServer
+        control = ControlServer(self, util.CONTROL_SOCKET_FILE)
+        return control if control.open() else None
 
     def prepare_stop(self):
         log.warning("Exiting safely. Bye.")
-        # Save the list only if it changed during runtime.
-        if self.blocklist != self.orglist:
-            self.blocklist.save()
+        if self.control is not None:
+            self.control.close()
+        if metrics.enabled:
+            self.write_metrics()
+        # Save whatever of the blocklist was not persisted yet.
+        self.blocklist.close()
+        log.info(f"Decision cache: {self.decisions.hits} hits, {self.decisions.misses} misses.")
+        log.info(f"Player events: {self.coalescer.dropped} unchanged dropped, {self.coalescer.merged} merged.")
         # Unmute before exiting.
         self.unmute()
         self.blocking = False
+        self.muter.close()
 
     def stop(self):
         self.prepare_stop()
@@ -238,13 +480,24 @@ class Blockify(object):
 
 def initialize(doc=__doc__):
     try:
-        args = util.docopt(doc, version=f"blockify {util.VERSION}")
+        args = util.docopt(doc, version=util.Version("blockify"))
     except Exception:
         args = None
     util.initialize(args)
-
-    _blocklist = blocklist.Blocklist()
-    cli = Blockify(_blocklist)
+    if util.CONFIG["cli"]["metrics_file"]:
+        metrics.enable()
+    if util.CONFIG["cli"]["trace_records"] > 0:
+        trace.enable(util.TRACE_FILE, util.CONFIG["cli"]["trace_records"])
+
+    _blocklist = blocklist.load_blocklist()
+    if util.CONFIG["cli"]["sessions"]:
+        from blockify.sessions import SupervisorBlockify
+        cli = SupervisorBlockify(_blocklist)
+    elif util.CONFIG["cli"]["players"]:
+        from blockify.players import MultiBlockify
+        cli = MultiBlockify(_blocklist)
+    else:
+        cli = Blockify(_blocklist)
 
     return cli
 
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""blockify-control
+
+Sends commands to a running blockify through its control socket, and prints
+its reply to each of them as a line of JSON. Without commands, they are read
+from stdin, one per line, and sent over the same connection.
+
+Usage:
+    blockify-control [<command>...] [-s <path>] [-q]
+
+Commands:
+    block          Block the current song, adding it to the blocklist.
+    unblock        Unblock the current song, removing it from the blocklist.
+    toggle         Toggle the mute state of the current song.
+    status         Print the current song and the mute state.
+    current-song   Print the current song.
+    reload         Read the blocklist again.
+
+Options:
+    -s, --socket=<path>  Path of the control socket [default: {socket}].
+    -q, --quiet          Don't print the replies. The exit code still tells if any command failed.
+    -h, --help           Show this help text.
+    --version            Show current version of blockify-control.
+"""
+import json
+import logging
+import os
+import socket
+import sys
+
+from blockify import util
+
+log = logging.getLogger("control")
+
+COMMANDS = ("block", "unblock", "toggle", "status", "current-song", "reload")
+
+
+class ControlServer(object):
+    """Unix socket through which commands reach blockify, handled on its main loop.
+
+    Every line received is a command and gets a line of JSON in reply, in order, so
+    that a client can send a batch of them at once and read the outcome of each.
+    """
+    def __init__(self, blockify, path: os.PathLike | str):
+        self.blockify = blockify
+        self.main_loop = blockify.main_loop
+        self.path = str(path)
+        self.server: socket.socket | None = None
+        self.watch = None
+        self.clients: dict[socket.socket, tuple[object, bytes]] = {}    # -> (watch, pending partial line)
+
+    def open(self) -> bool:
+        if self.is_in_use():
+            log.error(f"Another blockify is listening on {self.path}. Not listening for commands.")
+            return False
+        try:
+            # Left behind by a blockify that didn't exit cleanly.
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.error(f"Cannot replace the control socket at {self.path}: {e}")
+            return False
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(self.path)
+            # Only the user running blockify can control it.
+            os.chmod(self.path, 0o600)
+            server.listen()
+        except OSError as e:
+            log.error(f"Cannot open the control socket at {self.path}: {e}")
+            server.close()
+            return False
+        server.setblocking(False)
+        self.server = server
+        self.watch = self.main_loop.watch_fd(server.fileno(), self._accept)
+        log.info(f"Listening for commands on {self.path}.")
+        return True
+
+    def is_in_use(self) -> bool:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(self.path)
+            except OSError:
+                # Missing, or nobody accepts connections on it anymore.
+                return False
+        return True
+
+    def close(self):
+        for client, (watch, _) in list(self.clients.items()):
+            self.main_loop.source_remove(watch)
+            client.close()
+        self.clients.clear()
+        if self.server is not None:
+            self.main_loop.source_remove(self.watch)
+            self.server.close()
+            self.server = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def _accept(self) -> bool:
+        try:
+            client, _ = self.server.accept()
+        except BlockingIOError:
+            return True
+        # Replies are small: a slow reader can hold the loop for a second at most.
+        client.settimeout(1)
+        self.clients[client] = (self.main_loop.watch_fd(client.fileno(), lambda: self._receive(client)), b"")
+        return True
+
+    def _receive(self, client: socket.socket) -> bool:
+        watch, pending = self.clients[client]
+        try:
+            data = client.recv(4096)
+        except OSError:
+            data = b""
+        if not data:
+            del self.clients[client]
+            client.close()
+            return False
+        *lines, pending = (pending + data).split(b"\n")
+        self.clients[client] = (watch, pending)
+        replies = [json.dumps(self.handle(line.decode("utf-8", "replace").strip())) for line in lines if line.strip()]
+        if replies:
+            try:
+                client.sendall(("\n".join(replies) + "\n").encode("utf-8"))
+            except OSError as e:
+                log.warning(f"Failed replying to a control client: {e}")
+        return True
+
+    def handle(self, command: str) -> dict:
+        log.info(f"Control command received: {command}.")
+        reply = {"command": command, "ok": True}
+        blockify = self.blockify
+        try:
+            if command == "block":
+                song = blockify.current_song
+                if song:
+                    blockify.block_current()
+                    reply["song"] = song
+                else:
+                    reply.update(ok=False, error="no current song")
+            elif command == "unblock":
+                song = blockify.current_song
+                reply["song"] = song
+                if not blockify.unblock_current():
+                    reply.update(ok=False, error="not found in blocklist")
+            elif command == "toggle":
+                blockify.toggle()
+                reply.update(blockify.status())
+            elif command == "status":
+                reply.update(blockify.status())
+            elif command == "current-song":
+                reply["song"] = blockify.current_song
+            elif command == "reload":
+                blockify.reload()
+            else:
+                reply.update(ok=False, error=f"unknown command, expected one of: {', '.join(COMMANDS)}")
+        except Exception as e:
+            log.error(f"Control command {command} failed: {e}")
+            reply.update(ok=False, error=str(e))
+        return reply
+
+
+def send(path: str, batches, output=None) -> bool:
+    """Sends each batch of commands at once and writes their replies to output.
+
+    Returns whether all the commands succeeded.
+    """
+    ok = True
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        replies = client.makefile("r", encoding="utf-8")
+        for batch in batches:
+            commands = [command.strip() for command in batch if command.strip()]
+            if not commands:
+                continue
+            client.sendall("".join(f"{command}\n" for command in commands).encode("utf-8"))
+            for _ in commands:
+                reply = replies.readline()
+                if not reply:
+                    raise ConnectionError("blockify closed the connection")
+                ok = ok and json.loads(reply)["ok"]
+                if output is not None:
+                    output.write(reply)
+                    output.flush()
+    return ok
+
+
+def main():
+    args = util.docopt(__doc__.format(socket=util.CONTROL_SOCKET_FILE), version=util.Version("blockify-control"))
+    # The commands given as arguments go in a single batch, those from stdin as soon as they're read.
+    batches = [args["<command>"]] if args["<command>"] else ([line] for line in sys.stdin)
+    try:
+        ok = send(args["--socket"], batches, None if args["--quiet"] else sys.stdout)
+    except (OSError, ValueError) as e:
+        print(f"Cannot reach blockify at {args['--socket']}: {e}", file=sys.stderr)
+        sys.exit(2)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
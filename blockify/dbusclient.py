@@ -5,6 +5,8 @@ Usage:
     dbusclient (toggle | next | prev | stop | play | pause) [-v...] [options]
     dbusclient get [song | title | artist | album | length | status | all] [-v...] [options]
     dbusclient (openuri <uri> | seek <secs> | setpos <pos>) [-v...] [options]
+    dbusclient --batch [-v...] [options]
+    dbusclient --follow [--format=<fmt>] [-v...] [options]
 
 Options:
     -l, --log=<path>  Enables logging to the logfile/-path specified.
@@ -12,11 +14,16 @@ Options:
     -v                Verbosity of the logging module, up to -vvv.
     -h, --help        Show this help text.
     --version         Show current version of dbusclient.
+    --batch           Run the commands read from stdin, one per line (e.g. "get title"), over a single connection.
+    --follow          Print a line every time the song or the playback status changes.
+    --format=<fmt>    Line printed by --follow, with any of {song}, {artist}, {title}, {album},
+                      {length} and {status} [default: {status}: {song}].
 """
 import logging
+import os
 import re
+import shlex
 import sys
-import time
 
 import dbus # from dbus-python package
 import dbus.types
@@ -24,30 +31,64 @@ import dbus.exceptions
 from dbus.connection import SignalMatch
 from dbus.mainloop.glib import DBusGMainLoop
 
-from blockify import util
+from blockify import metrics, trace, util
+from blockify.mpris import EventCoalescer, MprisClient
 
 log = logging.getLogger("dbus")
 
 
 dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 
-class SpotifyDBusClient(object):
+class TimedInterface(object):
+    """Wraps a dbus.Interface, observing the round-trip time of every method call."""
+    def __init__(self, interface: dbus.Interface):
+        self.interface = interface
+
+    def __getattr__(self, name):
+        method = getattr(self.interface, name)
+
+        def call(*args, **kwargs):
+            with metrics.Timer("blockify_dbus_call_seconds", method=name):
+                return method(*args, **kwargs)
+        return call
+
+class SpotifyDBusClient(MprisClient):
     """Wrapper for Spotify's DBus interface."""
 
-    def __init__(self):
+    def __init__(self, bus_name: str = "org.mpris.MediaPlayer2.spotify"):
         self.obj_path = "/org/mpris/MediaPlayer2"
         self.prop_path = "org.freedesktop.DBus.Properties"
         self.player_path = "org.mpris.MediaPlayer2.Player"
         # self.spotify_path = None
-        self.spotify_path = "org.mpris.MediaPlayer2.spotify" # instead of bus.list_names() bus
+        self.spotify_path = bus_name # instead of bus.list_names() bus
         self.session_bus = None
+        self.owner_watch = None
+        self.owner = ""             # unique name of spotify on the bus, if running
+        self.is_connected = False
+        self.connected_handlers = []
+        self.closed_handlers = []
+        self.snapshot: dict | None = None   # player's properties, until they change
+        self.snapshot_match = None
 
     def get_xdg_dbus(self):
         return self.session_bus.get_object(
             bus_name="org.freedesktop.DBus", object_path="/org/freedesktop/DBus"
         )
 
-    def connect(self, bus=None):
+    def on_connected(self, fun):
+        """Calls fun every time spotify appears on the bus and the client attaches to it."""
+        self.connected_handlers.append(fun)
+
+    def on_closed(self, fun):
+        """Calls fun when spotify leaves the bus, e.g. because it was closed."""
+        self.closed_handlers.append(fun)
+
+    def connect(self, bus=None) -> bool:
+        """Attaches to spotify if it is running, without waiting for it otherwise.
+
+        Any later instance of spotify is attached to as soon as it appears on the
+        bus, as long as the main loop runs. Returns whether spotify is connected.
+        """
         if not bus:
             bus = dbus.SessionBus()
         self.session_bus = bus
@@ -61,17 +102,60 @@ class SpotifyDBusClient(object):
         #     log.warning("SPOTIFY PATH:"+self.spotify_path)
 
         log.info("Connecting to spotify...")
-        not_connected = True
-        while not_connected:
+        if self.snapshot_match is None:
+            # Added before any other receiver, so that they find the snapshot up to date.
+            self.snapshot_match = self.on_property_change(self._update_snapshot)
+        if self.owner_watch is None:
+            # Also called once with the current owner, when the main loop runs.
+            self.owner_watch = bus.watch_name_owner(self.spotify_path, self._on_owner_changed)
+        if not self.is_connected:
             try:
-                self.proxy = self.session_bus.get_object(self.spotify_path,
-                                                        self.obj_path)
-                self.properties = dbus.Interface(self.proxy, self.prop_path)
-                self.player = dbus.Interface(self.proxy, self.player_path)
-                not_connected = False
+                self._on_owner_changed(bus.get_name_owner(self.spotify_path))
             except dbus.exceptions.DBusException:
-                time.sleep(2)
+                log.info("Spotify is not running. Waiting for it to start.")
+        return self.is_connected
+
+    def close(self):
+        """Stops following spotify's bus name."""
+        if self.owner_watch is not None:
+            self.owner_watch.cancel()
+            self.owner_watch = None
+        if self.snapshot_match is not None:
+            self.snapshot_match.remove()
+            self.snapshot_match = None
+
+    def _on_owner_changed(self, owner: str):
+        if owner == self.owner:
+            return
+        self.owner = owner
+        self.snapshot = None
+        if not owner:
+            self.is_connected = False
+            if metrics.enabled:
+                metrics.inc("blockify_spotify_disconnections_total")
+            if trace.enabled:
+                trace.record(trace.Kind.CLOSED)
+            for fun in self.closed_handlers:
+                fun()
+            return
+        try:
+            self.proxy = self.session_bus.get_object(self.spotify_path, self.obj_path)
+            self.properties = dbus.Interface(self.proxy, self.prop_path)
+            self.player = dbus.Interface(self.proxy, self.player_path)
+        except dbus.exceptions.DBusException as e:
+            # Closed again in the meantime: the watch reports it.
+            log.error(f"Failed connecting to spotify: {e}")
+            return
+        if metrics.enabled:
+            self.properties = TimedInterface(self.properties)
+            self.player = TimedInterface(self.player)
+            metrics.inc("blockify_spotify_connections_total")
+        if trace.enabled:
+            trace.record(trace.Kind.CONNECTED)
+        self.is_connected = True
         log.info("Connection established!")
+        for fun in self.connected_handlers:
+            fun()
 
     def on_property_change(self, fun) -> SignalMatch:
         return self.session_bus.add_signal_receiver(
@@ -82,7 +166,17 @@ class SpotifyDBusClient(object):
             path="/org/mpris/MediaPlayer2"
         )
 
-    def on_metadata_and_playback_change(self, fun) -> SignalMatch:
+    def on_seeked(self, fun) -> SignalMatch:
+        """Calls fun with the new position (in microseconds) whenever the playback jumps."""
+        return self.session_bus.add_signal_receiver(
+            handler_function=fun,
+            signal_name="Seeked",
+            dbus_interface=self.player_path,
+            bus_name=self.spotify_path,
+            path=self.obj_path
+        )
+
+    def on_metadata_and_playback_change(self, fun, coalescer: EventCoalescer | None = None) -> SignalMatch:
         def _playback_status_changed(
             interface_name: str,
             changed_properties: dict[str, str],
@@ -93,19 +187,36 @@ class SpotifyDBusClient(object):
                 or ("Metadata" not in changed_properties and "PlaybackStatus" not in changed_properties)
             ):
                 return
-            if "PlaybackStatus" in changed_properties:
-                if "Playing" == str(changed_properties["PlaybackStatus"]):
-                    metadata = self._get_metadata()
-                else:
-                    return
-            else:
-                metadata: dbus.types.Dictionary = changed_properties["Metadata"]
             # log.debug(f"metadata changed: interface={interface_name}, changed_properties={changed_properties}, invalidated_properties={invalidated_properties}")
-            fun(metadata)
+            self._metadata_or_playback_changed(changed_properties, fun, coalescer)
         return self.on_property_change(_playback_status_changed)
 
+    def get_snapshot(self) -> dict:
+        """Gets all the player's properties with a single call, then keeps them until they change."""
+        if self.snapshot is None:
+            try:
+                self.snapshot = dict(self.properties.GetAll(self.player_path))
+            except Exception as e:
+                log.error(f"Failed to get DBus properties: {e}")
+                return {}
+        return self.snapshot
+
+    def _update_snapshot(self, interface_name, changed_properties, invalidated_properties):
+        if interface_name != self.player_path or self.snapshot is None:
+            return
+        if invalidated_properties:
+            # Their new values are not in the signal: read them all again when needed.
+            self.snapshot = None
+        else:
+            self.snapshot.update(changed_properties)
+
     def get_property(self, key):
         """Gets the value from any available property."""
+        # The position changes all the time without any signal, it's always read.
+        if key != "Position":
+            snapshot = self.get_snapshot()
+            if key in snapshot:
+                return snapshot[key]
         prop = None
         try:
             prop = self.properties.Get(self.player_path, key)
@@ -182,104 +293,11 @@ class SpotifyDBusClient(object):
         except Exception as e:
             log.error(f"Cannot Seek: {e}")
 
-    def _get_metadata(self) -> dict:
-        """Get a dictionary with all metadata"""
-        return self.get_property("Metadata")
-
-    def get_song_length(self, metadata=None):
-        """Gets the length of current song from metadata (in seconds)."""
-        length = 0
-        try:
-            if metadata is None:
-                metadata = self._get_metadata()
-            length = int(metadata["mpris:length"] / 1000000)
-        except Exception as e:
-            log.error(f"Cannot get song length: {e}")
-
-        return length
-
-    def get_art_url(self, metadata=None):
-        """Get album cover"""
-        art_url = ""
-        try:
-            if metadata is None:
-                metadata = self._get_metadata()
-            art_url = str(metadata["mpris:artUrl"])
-        except Exception as e:
-            log.error(f"Cannot fetch album cover url: {e}")
-
-        return art_url
-
-    def get_spotify_url(self, metadata=None):
-        """Get spotify url for the track."""
-        spotify_url = ""
-        try:
-            if metadata is None:
-                metadata = self._get_metadata()
-            spotify_url = str(metadata["xesam:url"])
-        except Exception as e:
-            log.error(f"Cannot fetch spotify url: {e}")
-
-        return spotify_url
-
-    def get_song_status(self):
-        """Get current PlaybackStatus (Paused/Playing...)."""
-        status = ""
-        try:
-            status = str(self.get_property("PlaybackStatus"))
-        except Exception as e:
-            log.error(f"Cannot get PlaybackStatus: {e}")
-
-        return status
-
-    def get_song(self):
-        artist = self.get_song_artist()
-        title = self.get_song_title()
-        album = self.get_song_album()
-
-        return f"{artist} - {title} [{album}]"
-
-    def get_song_title(self, metadata=None):
-        """Gets title of current song from metadata"""
-        title = ""
-        try:
-            if metadata is None:
-                metadata = self._get_metadata()
-            title = str(metadata["xesam:title"])
-        except Exception as e:
-            log.error(f"Cannot get song title: {e}")
-
-        return title
-
-    def get_song_album(self, metadata=None):
-        """Gets album of current song from metadata"""
-        album = ""
-        try:
-            if metadata is None:
-                metadata = self._get_metadata()
-            album = str(metadata["xesam:album"])
-        except Exception as e:
-            log.error(f"Cannot get song album: {e}")
-
-        return album
-
-    def get_song_artist(self, metadata=None):
-        """Gets the artist of current song from metadata"""
-        artist = ""
-        try:
-            if metadata is None:
-                metadata = self._get_metadata()
-            artist = str(metadata["xesam:artist"][0])
-        except Exception as e:
-            log.error(f"Cannot get song artist: {e}")
-
-        return artist
-
 
 def print_all(dbus_client):
     """Print all the DBus info we can get our hands on."""
     try:
-        metadata = dbus_client.get_metadata()
+        metadata = dbus_client._get_metadata()
 
         d_keys = list(metadata.keys())
         d_keys.sort()
@@ -299,22 +317,36 @@ def print_all(dbus_client):
 
 
 def print_song(dbus_client):
-    length = dbus_client.get_song_length()
+    # A single metadata read for all the fields.
+    metadata = dbus_client._get_metadata()
+    length = dbus_client.get_song_length(metadata)
     m, s = divmod(length, 60)
-    rating = dbus_client.get_metadata()["xesam:autoRating"]
-    song = dbus_client.get_song()
+    rating = metadata.get("xesam:autoRating", "")
+    song = dbus_client.get_song(metadata)
     print(f"{song}, {m}m{s}s, {rating}")
 
 
+def format_song(dbus_client, fmt: str) -> str:
+    metadata = dbus_client._get_metadata()
+    return fmt.format(
+        song=dbus_client.get_song(metadata),
+        artist=dbus_client.get_song_artist(metadata),
+        title=dbus_client.get_song_title(metadata),
+        album=dbus_client.get_song_album(metadata),
+        length=dbus_client.get_song_length(metadata),
+        status=dbus_client.get_song_status(),
+    )
+
+
 def wrap_action(action, *args):
     return {"action": action, "args": args}
 
 
-def main():
-    """Entry point for the CLI DBus interface."""
-    args = util.docopt(__doc__, version="0.4.1")
-    util.init_logger(args["--log"], args["-v"], args["--quiet"])
-    dbus_client = SpotifyDBusClient()
+def run(dbus_client, args) -> bool:
+    """Runs the command given in args, printing its result. Returns whether spotify could be reached."""
+    if not dbus_client.is_connected:
+        log.error("Spotify is not running.")
+        return False
 
     args_mapper = {
         "setpos": wrap_action(dbus_client.set_position, args["<pos>"]),
@@ -344,11 +376,99 @@ def main():
                 result = action(*action_args) if action_args else action()
                 if result:
                     print(result)
-                exit(0)
+                return True
 
     # Since get can have follow-up actions it has to be handled last and separately.
     if args.get("get", None):
         print_song(dbus_client)
+    return True
+
+
+def run_batch(dbus_client):
+    """Runs the commands read from stdin as they come, on the main loop, so that the properties stay up to date."""
+    from docopt import DocoptExit
+    from blockify.mainloops import GLibMainLoop
+
+    main_loop = GLibMainLoop()
+    stdin = sys.stdin.fileno()
+    pending = b""
+
+    def run_line(line: str):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            return
+        try:
+            args = util.docopt(__doc__, argv=shlex.split(line), help=False)
+        except (DocoptExit, ValueError):
+            log.error(f"Invalid command: {line}")
+            return
+        if args["--batch"] or args["--follow"]:
+            log.error(f"Invalid command in batch mode: {line}")
+            return
+        run(dbus_client, args)
+        sys.stdout.flush()
+
+    def read_commands() -> bool:
+        nonlocal pending
+        data = os.read(stdin, 4096)
+        if not data:
+            run_line(pending.decode("utf-8", "replace"))
+            main_loop.quit()
+            return False
+        *lines, pending = (pending + data).split(b"\n")
+        for line in lines:
+            run_line(line.decode("utf-8", "replace"))
+        return True
+
+    main_loop.watch_fd(stdin, read_commands)
+    main_loop.run()
+
+
+def follow(dbus_client, fmt: str):
+    """Prints a line every time the song or the playback status changes, and an empty one when spotify closes."""
+    from blockify.mainloops import GLibMainLoop
+
+    main_loop = GLibMainLoop()
+    last_line = None
+
+    def print_line(line: str):
+        nonlocal last_line
+        if line != last_line:
+            print(line, flush=True)
+            last_line = line
+
+    def properties_changed(interface_name, changed_properties, invalidated_properties):
+        if (
+            interface_name == dbus_client.player_path
+            and ("Metadata" in changed_properties or "PlaybackStatus" in changed_properties)
+        ):
+            print_line(format_song(dbus_client, fmt))
+
+    dbus_client.on_connected(lambda: print_line(format_song(dbus_client, fmt)))
+    dbus_client.on_closed(lambda: print_line(""))
+    dbus_client.on_property_change(properties_changed)
+    if dbus_client.is_connected:
+        print_line(format_song(dbus_client, fmt))
+    main_loop.run()
+
+
+def main():
+    """Entry point for the CLI DBus interface."""
+    args = util.docopt(__doc__, version="0.4.1")
+    util.init_logger(args["--log"], args["-v"], args["--quiet"])
+    dbus_client = SpotifyDBusClient()
+    # Returns at once: --batch and --follow attach to spotify whenever it starts.
+    dbus_client.connect()
+
+    try:
+        if args["--batch"]:
+            run_batch(dbus_client)
+        elif args["--follow"]:
+            follow(dbus_client, args["--format"])
+        elif not run(dbus_client, args):
+            exit(1)
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == "__main__":
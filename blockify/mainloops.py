@@ -0,0 +1,90 @@
+import logging
+
+log = logging.getLogger("loop")
+
+
+class GLibMainLoop(object):
+    """GLib's main loop, which dbus-python and Gio's file monitors dispatch their events on."""
+    watches_files = True
+
+    def __init__(self):
+        import gi
+        gi.require_version("Gtk", "4.0")
+        from gi.repository import GLib
+        self.glib = GLib
+        self.loop = GLib.MainLoop()
+
+    def run(self):
+        self.loop.run()
+
+    def quit(self):
+        self.loop.quit()
+
+    def timeout_add(self, interval: int, fun, *args):
+        return self.glib.timeout_add(interval, fun, *args)
+
+    def watch_fd(self, fd: int, fun):
+        """Calls fun every time fd is readable or hung up, for as long as it returns True."""
+        return self.glib.io_add_watch(fd, self.glib.PRIORITY_DEFAULT, self.glib.IO_IN | self.glib.IO_HUP,
+                                      lambda fd, condition: fun())
+
+    def source_remove(self, source):
+        self.glib.source_remove(source)
+
+
+class AsyncioTimeout(object):
+    def __init__(self):
+        self.handle = None
+
+    def cancel(self):
+        self.handle.cancel()
+
+
+class AsyncioWatch(object):
+    def __init__(self, loop, fd: int):
+        self.loop = loop
+        self.fd = fd
+
+    def cancel(self):
+        self.loop.remove_reader(self.fd)
+
+
+class AsyncioMainLoop(object):
+    """An asyncio event loop with the same interface as GLibMainLoop, for the jeepney DBus client."""
+    watches_files = False   # Gio's file monitors would never be dispatched
+
+    def __init__(self):
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def run(self):
+        self.loop.run_forever()
+
+    def quit(self):
+        self.loop.stop()
+
+    def timeout_add(self, interval: int, fun, *args) -> AsyncioTimeout:
+        """Calls fun every interval ms for as long as it returns True, like GLib.timeout_add."""
+        timeout = AsyncioTimeout()
+
+        def call():
+            if fun(*args):
+                timeout.handle = self.loop.call_later(interval / 1000, call)
+
+        timeout.handle = self.loop.call_later(interval / 1000, call)
+        return timeout
+
+    def watch_fd(self, fd: int, fun) -> AsyncioWatch:
+        """Calls fun every time fd is readable, for as long as it returns True, like GLib.io_add_watch."""
+        watch = AsyncioWatch(self.loop, fd)
+
+        def call():
+            if not fun():
+                watch.cancel()
+
+        self.loop.add_reader(fd, call)
+        return watch
+
+    def source_remove(self, source: AsyncioTimeout | AsyncioWatch):
+        source.cancel()
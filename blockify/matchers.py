@@ -0,0 +1,237 @@
+import bisect
+import fnmatch
+import logging
+import re
+
+log = logging.getLogger("matchers")
+
+PATTERN_PREFIXES = ("re:", "glob:")
+# Leading global flags, e.g. "(?i)", which can't stay global inside the combined regex.
+LEADING_FLAGS = re.compile(r"\(\?([aiLmsux]+)\)")
+# \1 (not escaped itself) or (?(1)...): group numbers change inside the combined regex.
+NUMBERED_REFERENCE = re.compile(r"(?<!\\)(?:\\\\)*\\[1-9]|\(\?\(\d")
+
+
+class SubstringMatcher():
+    """Aho-Corasick automaton over blocklist entries.
+
+    find() returns the entry that was added first among those contained in the
+    given string, i.e. the same entry a linear `item in song` scan would return.
+    """
+    def __init__(self, items=()):
+        self.goto: list[dict[str, int]] = [{}]
+        self.terminal: list[int] = [-1]     # rank of the entry ending in each node, -1 if none
+        self.ranks: dict[str, int] = {}     # entry -> insertion order
+        self.entries: dict[int, str] = {}   # insertion order -> entry
+        self.next_rank = 0
+        self.fail: list[int] = []
+        self.best: list[int] = []           # lowest rank reachable through the fail links
+        self.stale = True
+        for item in items:
+            self.add(item)
+
+    def add(self, item: str):
+        if not item or item in self.ranks:
+            return
+        rank = self.next_rank
+        self.next_rank += 1
+        self.ranks[item] = rank
+        self.entries[rank] = item
+        node = 0
+        for char in item:
+            child = self.goto[node].get(char)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][char] = child
+                self.goto.append({})
+                self.terminal.append(-1)
+            node = child
+        self.terminal[node] = rank
+        self.stale = True
+
+    def discard(self, item: str):
+        rank = self.ranks.pop(item, None)
+        if rank is None:
+            return
+        del self.entries[rank]
+        node = 0
+        for char in item:
+            node = self.goto[node][char]
+        # The path stays in the trie: without a terminal rank it can't match anything.
+        self.terminal[node] = -1
+        self.stale = True
+
+    def _build(self):
+        """Computes failure links and the best rank of each node, breadth-first."""
+        nodes = len(self.goto)
+        self.fail = [0] * nodes
+        self.best = self.terminal[:]
+        queue = list(self.goto[0].values())
+        for node in queue:
+            fail = self.fail[node]
+            fail_best = self.best[fail]
+            if fail_best >= 0 and (self.best[node] < 0 or fail_best < self.best[node]):
+                self.best[node] = fail_best
+            for char, child in self.goto[node].items():
+                state = fail
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(char, 0)
+                queue.append(child)
+        self.stale = False
+
+    def find(self, text: str) -> str | None:
+        if self.stale:
+            self._build()
+        goto, fail, best = self.goto, self.fail, self.best
+        found = -1
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            rank = best[state]
+            if rank >= 0 and (found < 0 or rank < found):
+                found = rank
+        return self.entries[found] if found >= 0 else None
+
+
+class PrefixMatcher():
+    """Sorted index of blocklist entries for the default, greedy prefix search.
+
+    The song is matched against entries starting with it, halving it until a
+    match is found. Among the candidates the entry that was added first wins.
+    """
+    def __init__(self, items=()):
+        self.ranks: dict[str, int] = {}     # entry -> insertion order
+        self.next_rank = 0
+        for item in items:
+            if item and item not in self.ranks:
+                self.ranks[item] = self.next_rank
+                self.next_rank += 1
+        self.sorted: list[str] = sorted(self.ranks)
+
+    def add(self, item: str):
+        if not item or item in self.ranks:
+            return
+        self.ranks[item] = self.next_rank
+        self.next_rank += 1
+        bisect.insort(self.sorted, item)
+
+    def discard(self, item: str):
+        if self.ranks.pop(item, None) is None:
+            return
+        del self.sorted[bisect.bisect_left(self.sorted, item)]
+
+    def find(self, song: str) -> str | None:
+        # Arbitrary minimum length of 4 to avoid ambiguous song names.
+        while len(song) > 4:
+            found = None
+            # All the entries starting with song are contiguous in sorted order.
+            i = bisect.bisect_left(self.sorted, song)
+            while i < len(self.sorted) and self.sorted[i].startswith(song):
+                item = self.sorted[i]
+                if found is None or self.ranks[item] < self.ranks[found]:
+                    found = item
+                i += 1
+            if found is not None:
+                return found
+            song = song[:len(song) // 2]
+        return None
+
+
+class PatternMatcher():
+    """Matches "re:" and "glob:" entries with a single combined regex.
+
+    Every other entry is left to the literal matcher it wraps, which is tried first.
+    """
+    def __init__(self, literal_matcher_class, items=()):
+        self.patterns: dict[str, str] = {}  # entry -> regex, in insertion order
+        self.groups: dict[str, str] = {}    # group name in the combined regex -> entry
+        self.regex: re.Pattern | None = None
+        self.stale = True
+        literals = []
+        for item in items:
+            if item.startswith(PATTERN_PREFIXES):
+                self.add(item)
+            else:
+                literals.append(item)
+        self.literal = literal_matcher_class(literals)
+
+    @staticmethod
+    def to_regex(item: str) -> str:
+        """Returns the regex of the entry, as it can be an alternative of the combined regex."""
+        if item.startswith("glob:"):
+            regex = r"\A" + fnmatch.translate(item[len("glob:"):])
+        else:
+            regex = item[len("re:"):]
+            if re.compile(regex).groupindex:
+                raise re.error("named groups are not supported")
+            if NUMBERED_REFERENCE.search(regex):
+                raise re.error("numbered backreferences are not supported")
+            flags = ""
+            while match := LEADING_FLAGS.match(regex):
+                flags += match.group(1)
+                regex = regex[match.end():]
+            if flags:
+                # Scoped to the entry, instead of applying to all the others. In verbose
+                # mode, a newline ends any trailing comment before the group is closed.
+                regex = f"(?{flags}:{regex}{chr(10) if 'x' in flags else ''})"
+        # Compiled as it will be in the combined regex.
+        re.compile(f"(?P<pattern0>{regex})")
+        return regex
+
+    def add(self, item: str):
+        if not item.startswith(PATTERN_PREFIXES):
+            self.literal.add(item)
+            return
+        if item in self.patterns:
+            return
+        try:
+            self.patterns[item] = self.to_regex(item)
+        except re.error as e:
+            log.error(f"Ignoring invalid blocklist pattern {item}: {e}")
+            return
+        self.stale = True
+
+    def discard(self, item: str):
+        if not item.startswith(PATTERN_PREFIXES):
+            self.literal.discard(item)
+            return
+        if self.patterns.pop(item, None) is not None:
+            self.stale = True
+
+    def _build(self):
+        self.groups = {f"pattern{i}": item for i, item in enumerate(self.patterns)}
+        alternatives = [f"(?P<{name}>{self.patterns[item]})" for name, item in self.groups.items()]
+        try:
+            self.regex = re.compile("|".join(alternatives)) if alternatives else None
+        except re.error as e:
+            # A failing pattern must not stop the literal entries and the ad detection from working.
+            log.error(f"Cannot combine the blocklist patterns: {e}. Dropping those that can't be combined.")
+            self.regex = self._combine_valid()
+        self.stale = False
+        log.debug(f"Compiled {len(alternatives)} blocklist patterns.")
+
+    def _combine_valid(self) -> re.Pattern | None:
+        alternatives = []
+        for name, item in self.groups.items():
+            alternative = f"(?P<{name}>{self.patterns[item]})"
+            try:
+                re.compile("|".join([*alternatives, alternative]))
+            except re.error as e:
+                log.error(f"Ignoring blocklist pattern {item}: {e}")
+                continue
+            alternatives.append(alternative)
+        return re.compile("|".join(alternatives)) if alternatives else None
+
+    def find(self, song: str) -> str | None:
+        found = self.literal.find(song)
+        if found is not None:
+            return found
+        if self.stale:
+            self._build()
+        if self.regex is None:
+            return None
+        match = self.regex.search(song)
+        return self.groups[match.lastgroup] if match else None
@@ -0,0 +1,127 @@
+"""Counters and histograms of what blockify does, written out in Prometheus' text format.
+
+Metrics are off unless enable() is called. Instrumented code checks `enabled`
+before measuring anything, so that they cost a global lookup when off.
+"""
+import bisect
+import logging
+import os
+import time
+
+log = logging.getLogger("metrics")
+
+enabled = False
+
+# Upper bounds of the histograms' buckets, in seconds.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+DESCRIPTIONS = {
+    "blockify_ads_detected_total": ("counter", "Tracks detected as ads."),
+    "blockify_blocklist_hits_total": ("counter", "Tracks found in the blocklist."),
+    "blockify_decision_seconds": ("histogram", "Time taken to decide whether to block a track."),
+    "blockify_event_to_mute_seconds": ("histogram", "Time from the player's event to the end of the mute."),
+    "blockify_subprocess_seconds": ("histogram", "Commands spawned by the muters and their duration."),
+    "blockify_dbus_call_seconds": ("histogram", "DBus calls to the player and their round-trip time."),
+    "blockify_spotify_connections_total": ("counter", "Times the client attached to spotify."),
+    "blockify_spotify_disconnections_total": ("counter", "Times spotify left the bus."),
+}
+
+counters: dict[tuple[str, tuple], float] = {}
+histograms: dict[tuple[str, tuple], "Histogram"] = {}
+
+
+class Histogram(object):
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)    # not cumulative: rendered as such
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(BUCKETS, value)
+        if i < len(BUCKETS):
+            self.buckets[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def enable():
+    global enabled
+    enabled = True
+    log.info("Metrics enabled.")
+
+
+def inc(name: str, value: float = 1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = Histogram()
+    histogram.observe(value)
+
+
+class Timer(object):
+    """Context manager observing the time spent in its block into a histogram."""
+    def __init__(self, name: str, **labels):
+        self.name = name
+        self.labels = labels
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.monotonic() - self.started, **self.labels)
+
+
+def _format_labels(labels: tuple, *extra: tuple[str, str]) -> str:
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def render() -> str:
+    lines = []
+    described = set()
+
+    def describe(name):
+        if name not in described:
+            described.add(name)
+            kind, description = DESCRIPTIONS.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        describe(name)
+        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+    for (name, labels), histogram in sorted(histograms.items()):
+        describe(name)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram.buckets):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, ('le', f'{bound:g}'))} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {histogram.count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def write(path: os.PathLike | str):
+    """Replaces the file at path with the current metrics, atomically, e.g. for node_exporter's textfile collector."""
+    path = str(path)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(render())
+        os.replace(temporary, path)
+    except OSError as e:
+        log.error(f"Cannot write metrics to {path}: {e}")
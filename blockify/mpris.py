@@ -0,0 +1,248 @@
+import logging
+import time
+
+from blockify import metrics, trace
+
+log = logging.getLogger("dbus")
+
+
+class EventCoalescer(object):
+    """Merges bursts of player events and drops those that change neither the track nor the playback status.
+
+    The first event after a quiet period is passed on at once. Events that follow
+    within the window are held, and only the last one is passed on when the window
+    ends, unless urgent(metadata) is true, e.g. for ads, which are never delayed.
+    Dropped events are passed on to dropped(metadata), if given.
+    """
+    def __init__(self, window: int, main_loop, urgent=None, dropped=None):
+        self.window = window    # in ms
+        self.main_loop = main_loop
+        self.urgent = urgent or (lambda metadata: False)
+        self.on_dropped = dropped
+        self.last_key = None    # (track id, song, playback status) of the last event
+        self.pending = None     # (fun, metadata) held until the end of the window
+        self.timer = None
+        self.dropped = 0
+        self.merged = 0
+
+    def push(self, key: tuple, metadata, fun):
+        """Passes metadata on to fun, now or at the end of the window. None only updates the status."""
+        if key == self.last_key:
+            self.dropped += 1
+            if self.on_dropped is not None:
+                self.on_dropped(metadata)
+            return
+        self.last_key = key
+        if self.pending is not None:
+            # Superseded by this event.
+            self.pending = None
+            self.merged += 1
+        if metadata is None:
+            return
+        if self.timer is None or self.urgent(metadata):
+            fun(metadata)
+            self.start_window()
+        else:
+            self.pending = (fun, metadata)
+
+    def start_window(self):
+        if self.timer is not None:
+            self.main_loop.source_remove(self.timer)
+            self.timer = None
+        if self.window > 0:
+            self.timer = self.main_loop.timeout_add(self.window, self.end_window)
+
+    def end_window(self):
+        self.timer = None
+        if self.pending is not None:
+            (fun, metadata), self.pending = self.pending, None
+            fun(metadata)
+            self.start_window()
+        return False
+
+
+class MprisClient(object):
+    """Getters for the current song shared by the DBus clients, on top of their get_property()."""
+    event_at = None     # monotonic time of the last player's event, only if metrics are enabled
+    # Track ids that players give to any song, e.g. when they have no track list
+    shared_track_ids = frozenset({"/org/mpris/MediaPlayer2/TrackList/NoTrack",
+                                  "/org/chromium/MediaPlayer2/TrackList/TrackFooBar"})
+    last_track = None   # (track id, song) of the last track key asked for
+
+    def _metadata_or_playback_changed(self, changed_properties, fun, coalescer: EventCoalescer | None = None):
+        """Calls fun with the metadata when the track changes or starts playing, through coalescer if any."""
+        if metrics.enabled:
+            self.event_at = time.monotonic()
+        status = str(changed_properties["PlaybackStatus"]) if "PlaybackStatus" in changed_properties else None
+        if status is None:
+            metadata = changed_properties["Metadata"]
+        elif status == "Playing":
+            metadata = self._get_metadata()
+        else:
+            metadata = None
+        if trace.enabled:
+            trace.record(trace.Kind.PROPERTIES_CHANGED, self.get_track_id(metadata) if metadata is not None else "")
+        if coalescer is not None:
+            # The song too, as the track id may be the same for all of them.
+            coalescer.push((*self._get_track(metadata), status or self.get_song_status()), metadata, fun)
+        elif metadata is not None:
+            fun(metadata)
+
+    def _get_metadata(self) -> dict:
+        """Get a dictionary with all metadata"""
+        return self.get_property("Metadata")
+
+    def get_song_length(self, metadata=None):
+        """Gets the length of current song from metadata (in seconds)."""
+        length = 0
+        try:
+            if metadata is None:
+                metadata = self._get_metadata()
+            length = int(metadata["mpris:length"] / 1000000)
+        except Exception as e:
+            log.error(f"Cannot get song length: {e}")
+
+        return length
+
+    def get_song_length_us(self, metadata=None):
+        """Gets the length of current song from metadata (in microseconds)."""
+        length = 0
+        try:
+            if metadata is None:
+                metadata = self._get_metadata()
+            length = int(metadata["mpris:length"])
+        except Exception as e:
+            log.error(f"Cannot get song length: {e}")
+
+        return length
+
+    def get_song_position(self):
+        """Gets the playback position in the current song (in microseconds)."""
+        position = 0
+        try:
+            position = int(self.get_property("Position"))
+        except Exception as e:
+            log.error(f"Cannot get song position: {e}")
+
+        return position
+
+    def get_art_url(self, metadata=None):
+        """Get album cover"""
+        art_url = ""
+        try:
+            if metadata is None:
+                metadata = self._get_metadata()
+            art_url = str(metadata["mpris:artUrl"])
+        except Exception as e:
+            log.error(f"Cannot fetch album cover url: {e}")
+
+        return art_url
+
+    def get_spotify_url(self, metadata=None):
+        """Get spotify url for the track."""
+        spotify_url = ""
+        try:
+            if metadata is None:
+                metadata = self._get_metadata()
+            spotify_url = str(metadata["xesam:url"])
+        except Exception as e:
+            log.error(f"Cannot fetch spotify url: {e}")
+
+        return spotify_url
+
+    def get_track_id(self, metadata=None):
+        """Gets the MPRIS track id of the current song, or its spotify url if missing."""
+        track_id = ""
+        try:
+            if metadata is None:
+                metadata = self._get_metadata()
+            track_id = str(metadata.get("mpris:trackid") or metadata.get("xesam:url") or "")
+        except Exception as e:
+            log.error(f"Cannot get track id: {e}")
+
+        return track_id
+
+    def _get_track(self, metadata=None) -> tuple[str, tuple[str, ...]]:
+        """Gets the track id of the current song, and the song itself to tell apart those with the same id."""
+        track_id, song = "", ()
+        try:
+            if metadata is None:
+                metadata = self._get_metadata()
+            track_id = str(metadata.get("mpris:trackid") or metadata.get("xesam:url") or "")
+            song = tuple(str(metadata.get(name, "")) for name in ("xesam:artist", "xesam:title", "xesam:url"))
+        except Exception as e:
+            log.error(f"Cannot get track id: {e}")
+
+        return track_id, song
+
+    def get_track_key(self, metadata=None):
+        """Gets a key of the current song for caches shared with other players, or "" if it can't be told apart.
+
+        It's the track id with the bus name, unless the player gives that id to other
+        songs too, as players without a track list and Chromium do.
+        """
+        track_id, song = self._get_track(metadata)
+        if (self.last_track is not None and self.last_track[0] == track_id and self.last_track[1] != song
+                and track_id not in self.shared_track_ids):
+            log.info(f"{self.spotify_path} gives the track id {track_id} to different songs. Not caching them.")
+            self.shared_track_ids = self.shared_track_ids | {track_id}
+        self.last_track = (track_id, song)
+        if not track_id or track_id in self.shared_track_ids:
+            return ""
+        return f"{self.spotify_path} {track_id}"
+
+    def get_song_status(self):
+        """Get current PlaybackStatus (Paused/Playing...)."""
+        status = ""
+        try:
+            status = str(self.get_property("PlaybackStatus"))
+        except Exception as e:
+            log.error(f"Cannot get PlaybackStatus: {e}")
+
+        return status
+
+    def get_song(self, metadata=None):
+        if metadata is None:
+            metadata = self._get_metadata()
+        artist = self.get_song_artist(metadata)
+        title = self.get_song_title(metadata)
+        album = self.get_song_album(metadata)
+
+        return f"{artist} - {title} [{album}]"
+
+    def get_song_title(self, metadata=None):
+        """Gets title of current song from metadata"""
+        title = ""
+        try:
+            if metadata is None:
+                metadata = self._get_metadata()
+            title = str(metadata["xesam:title"])
+        except Exception as e:
+            log.error(f"Cannot get song title: {e}")
+
+        return title
+
+    def get_song_album(self, metadata=None):
+        """Gets album of current song from metadata"""
+        album = ""
+        try:
+            if metadata is None:
+                metadata = self._get_metadata()
+            album = str(metadata["xesam:album"])
+        except Exception as e:
+            log.error(f"Cannot get song album: {e}")
+
+        return album
+
+    def get_song_artist(self, metadata=None):
+        """Gets the artist of current song from metadata"""
+        artist = ""
+        try:
+            if metadata is None:
+                metadata = self._get_metadata()
+            artist = str(metadata["xesam:artist"][0])
+        except Exception as e:
+            log.error(f"Cannot get song artist: {e}")
+
+        return artist
+
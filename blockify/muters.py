@@ -1,8 +1,17 @@
+import configparser
+import ctypes
+import json
 import logging
+import os
 import re
 import shutil
 import subprocess
+import threading
+import time
 
+from pathlib import Path
+
+from blockify import metrics
 
 log = logging.getLogger("muters")
 
@@ -11,81 +20,314 @@ class SystemCommandNotFound(RuntimeError):
         self.command = command
         super().__init__(f"Command not found: {self.command}", *args)
 
+def spawn(run, args, **kwargs):
+    """Runs the command with run, one of subprocess' functions, and times it if metrics are enabled."""
+    if not metrics.enabled:
+        return run(args, **kwargs)
+    with metrics.Timer("blockify_subprocess_seconds", command=args if isinstance(args, str) else args[0]):
+        return run(args, **kwargs)
+
+def flatpak_app_id(pid: str) -> str | None:
+    """Returns the id of the flatpak app that the process runs in, if it is sandboxed.
+
+    It is also found for the xdg-dbus-proxy that owns the bus names of a flatpak
+    app, as the desktop portals do.
+    """
+    info = configparser.ConfigParser(interpolation=None)
+    try:
+        info.read_string(Path(f"/proc/{pid}/root/.flatpak-info").read_text())
+    except (OSError, configparser.Error):
+        return None
+    return info.get("Application", "name", fallback=None)
+
+class AlsaMixer():
+    """Minimal ctypes binding of alsa-lib's simple mixer API, to (un)mute without spawning amixer."""
+    # Argument types of the functions used, so that pointers aren't truncated to C ints.
+    functions = {
+        "snd_mixer_open": [ctypes.POINTER(ctypes.c_void_p), ctypes.c_int],
+        "snd_mixer_attach": [ctypes.c_void_p, ctypes.c_char_p],
+        "snd_mixer_selem_register": [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p],
+        "snd_mixer_load": [ctypes.c_void_p],
+        "snd_mixer_handle_events": [ctypes.c_void_p],
+        "snd_mixer_close": [ctypes.c_void_p],
+        "snd_mixer_selem_id_malloc": [ctypes.POINTER(ctypes.c_void_p)],
+        "snd_mixer_selem_id_free": [ctypes.c_void_p],
+        "snd_mixer_selem_id_set_name": [ctypes.c_void_p, ctypes.c_char_p],
+        "snd_mixer_find_selem": [ctypes.c_void_p, ctypes.c_void_p],
+        "snd_mixer_selem_has_playback_switch": [ctypes.c_void_p],
+        "snd_mixer_selem_get_playback_switch": [ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_int)],
+        "snd_mixer_selem_set_playback_switch_all": [ctypes.c_void_p, ctypes.c_int],
+    }
+
+    def __init__(self, card="default"):
+        import ctypes.util
+        library = ctypes.util.find_library("asound")
+        if library is None:
+            raise OSError("libasound not found")
+        self.lib = ctypes.CDLL(library)
+        for function, argtypes in AlsaMixer.functions.items():
+            getattr(self.lib, function).argtypes = argtypes
+        self.lib.snd_mixer_find_selem.restype = ctypes.c_void_p
+
+        self.handle = ctypes.c_void_p()
+        self._check("snd_mixer_open", self.lib.snd_mixer_open(ctypes.byref(self.handle), 0))
+        try:
+            self._check("snd_mixer_attach", self.lib.snd_mixer_attach(self.handle, card.encode()))
+            self._check("snd_mixer_selem_register", self.lib.snd_mixer_selem_register(self.handle, None, None))
+            self._check("snd_mixer_load", self.lib.snd_mixer_load(self.handle))
+        except OSError:
+            self.close()
+            raise
+
+    @staticmethod
+    def _check(function, result):
+        if result < 0:
+            raise OSError(f"{function} failed with error {result}")
+
+    def find(self, name: str):
+        """Returns the element of the simple control with the given name, or None."""
+        selem_id = ctypes.c_void_p()
+        self._check("snd_mixer_selem_id_malloc", self.lib.snd_mixer_selem_id_malloc(ctypes.byref(selem_id)))
+        self.lib.snd_mixer_selem_id_set_name(selem_id, name.encode())
+        element = self.lib.snd_mixer_find_selem(self.handle, selem_id)
+        self.lib.snd_mixer_selem_id_free(selem_id)
+        if not element or not self.lib.snd_mixer_selem_has_playback_switch(element):
+            return None
+        return element
+
+    def is_muted(self, element) -> bool:
+        # Applies the changes made by other processes, e.g. alsamixer, since the last call.
+        self.lib.snd_mixer_handle_events(self.handle)
+        switch = ctypes.c_int()
+        self.lib.snd_mixer_selem_get_playback_switch(element, 0, ctypes.byref(switch))  # 0 = front left/mono
+        return not switch.value
+
+    def set_muted(self, element, muted: bool):
+        self._check("snd_mixer_selem_set_playback_switch_all",
+                    self.lib.snd_mixer_selem_set_playback_switch_all(element, 0 if muted else 1))
+
+    def close(self):
+        if self.handle:
+            self.lib.snd_mixer_close(self.handle)
+            self.handle = ctypes.c_void_p()
+
 class AlsaMuter():
-    # requires alsa-utils
+    # requires alsa-lib, or alsa-utils as fallback
+    # Match simple mixer controls from output of "amixer"
+    amixer_control_pattern = re.compile(r"^Simple mixer control '(.*)',0$", re.MULTILINE)
     def __init__(self):
-        if shutil.which("amixer") is None:
-            raise SystemCommandNotFound("amixer")
+        try:
+            self.mixer = AlsaMixer()
+        except (OSError, AttributeError) as e:
+            log.info(f"Cannot use alsa-lib directly: {e}. Using amixer.")
+            self.mixer = None
+            if shutil.which("amixer") is None:
+                raise SystemCommandNotFound("amixer")
         self.is_muted = False
         self.channels = self._initialize_channels()
+        if not self.channels:
+            log.warning("No ALSA channel that can be muted was found.")
 
     def update(self):
-        for channel in self.channels:
-            output = subprocess.check_output(["amixer", "get", channel])
-            if "[off]" in output.decode("utf-8"):
-                self.is_muted = True
-                return
-        self.is_muted = False
-        return
+        if self.mixer is not None:
+            self.is_muted = any(self.mixer.is_muted(element) for element in self.channels.values())
+            return
+        # A single amixer call lists the state of all the simple controls.
+        amixer_output = spawn(subprocess.check_output, "amixer").decode("utf-8")
+        controls = self.amixer_control_pattern.split(amixer_output)[1:]
+        states = dict(zip(controls[::2], controls[1::2]))
+        self.is_muted = any("[off]" in states.get(channel, "") for channel in self.channels)
 
     def mute(self):
         """Mute method for systems without Pulseaudio. Mutes sound system-wide."""
-        self._update_audio_channel_state(["amixer", "-q", "set"], "mute")
+        self._update_audio_channel_state(True)
         self.is_muted = True
 
     def unmute(self):
         """Mute method for systems without Pulseaudio. Unmutes sound system-wide."""
-        self._update_audio_channel_state(["amixer", "-q", "set"], "unmute")
+        self._update_audio_channel_state(False)
         self.is_muted = False
 
-    def _initialize_channels(self):
+    def _initialize_channels(self) -> dict:
+        if self.mixer is not None:
+            elements = {channel: self.mixer.find(channel) for channel in ("Master", "Speaker", "Headphone")}
+            return {channel: element for channel, element in elements.items() if element is not None}
         channel_list = ["Master"]
-        amixer_output = subprocess.check_output("amixer")
+        amixer_output = spawn(subprocess.check_output, "amixer")
         if "'Speaker',0" in amixer_output.decode("utf-8"):
             channel_list.append("Speaker")
         if "'Headphone',0" in amixer_output.decode("utf-8"):
             channel_list.append("Headphone")
-        return channel_list
+        return dict.fromkeys(channel_list)
 
-    def _update_audio_channel_state(self, command, state):
-        for channel in self.channels:
-            try:
-                subprocess.Popen(command + [channel, state])
-            except subprocess.CalledProcessError:
-                pass
+    def _update_audio_channel_state(self, muted: bool):
+        """Sets all the channels at once and returns only when they are set."""
+        if self.mixer is not None:
+            for channel, element in self.channels.items():
+                try:
+                    self.mixer.set_muted(element, muted)
+                except OSError as e:
+                    log.error(f"Could not set {channel}: {e}")
+            return
+        state = "mute" if muted else "unmute"
+        # amixer reads the commands for all the channels from stdin, in a single process.
+        commands = "".join(f"sset {channel} {state}\n" for channel in self.channels)
+        result = spawn(subprocess.run, ["amixer", "-q", "-s"], input=commands, text=True)
+        if result.returncode != 0:
+            log.error(f"amixer failed to {state} {', '.join(self.channels)}.")
+
+    def close(self):
+        if self.mixer is not None:
+            self.mixer.close()
 
 class PulseMuter():
     # requires libpulse/pactl
-    def __init__(self):
+    # Match events from output of "pactl subscribe"
+    pactl_event_pattern = re.compile(r"Event '(?P<event>[\w-]+)' on (?P<facility>[\w-]+) #(?P<index>\d+)")
+
+    def __init__(self, subscribe=False, pid: str | None = None, server: str | None = None):
         if shutil.which("pactl") is None:
             raise SystemCommandNotFound("pactl")
         self.is_muted = False
+        self.pid = pid  # if given, only the clients of this process are muted, instead of any spotify
+        # In a flatpak, pulse reports the process id inside the sandbox: its clients are matched by app id too.
+        self.app_id = flatpak_app_id(pid) if pid else None
+        self.player = f"pid {pid}" + (f" (flatpak {self.app_id})" if self.app_id else "") if pid else "spotify"
+        self.warned_no_sinks = False
+        # if given, the pulse server to connect to instead of the default one, as in PULSE_SERVER
+        self.pactl = ["pactl", "--server", server] if server else ["pactl"]
         self.sinks: list[PulseSink] = []
+        self.subscription: subprocess.Popen | None = None
+        # State kept up to date by "pactl subscribe": spotify clients and all sink-inputs, by id.
+        self.spotify_clients: dict[str, PulseClient] = {}
+        self.sink_inputs: dict[str, PulseSink] = {}
+        self.stale = False      # an event couldn't be followed: the state above may be missing changes
+        self.pending = 0        # events being applied by the subscription thread
+        self.use_json = True    # until pactl proves it doesn't support "-f json"
+        if subscribe:
+            self._subscribe()
+
+    def _subscribe(self):
+        """Follows pulse's events, so that update() doesn't need to spawn pactl."""
+        self.subscription = subprocess.Popen([*self.pactl, "subscribe"], stdout=subprocess.PIPE, text=True)
+        self._refresh_clients()
+        self._refresh_sink_inputs()
+        threading.Thread(target=self._follow_events, name="pactl-subscribe", daemon=True).start()
+        log.info("Subscribed to pulse events.")
+
+    def _follow_events(self):
+        subscription = self.subscription
+        try:
+            for line in subscription.stdout:
+                match = PulseMuter.pactl_event_pattern.match(line)
+                if match is None:
+                    continue
+                event, facility, index = match.group("event", "facility", "index")
+                self.pending += 1
+                try:
+                    self._apply_event(event, facility, index)
+                except Exception as e:
+                    log.error(f"Failed following pulse's '{event}' event on {facility} #{index}: {e}. "
+                              "Reading pulse's state again at the next update.")
+                    self.stale = True
+                finally:
+                    self.pending -= 1
+        except Exception as e:
+            log.error(f"Failed reading 'pactl subscribe' output: {e}")
+            subscription.terminate()
+        if self.subscription is subscription:
+            # update() queries pulse itself from now on.
+            self.subscription = None
+            log.warning("'pactl subscribe' exited. Falling back to querying pulse at every update.")
+
+    def _apply_event(self, event: str, facility: str, index: str):
+        if facility == "client":
+            if event == "remove":
+                self.spotify_clients = {id: c for id, c in self.spotify_clients.items() if id != index}
+            else:
+                self._refresh_clients()
+        elif facility == "sink-input":
+            if event == "remove":
+                self.sink_inputs = {id: s for id, s in self.sink_inputs.items() if id != index}
+            else:
+                self._refresh_sink_inputs()
+
+    def _refresh_clients(self):
+        clients = self._pactl_list("clients", PulseClient)
+        self.spotify_clients = {client.id: client for client in clients if self.is_player(client)}
+
+    def _refresh_sink_inputs(self):
+        self.sink_inputs = {sink.id: sink for sink in self._pactl_list("sink-inputs", PulseSink)}
+
+    def is_player(self, client: "PulseClient") -> bool:
+        if not self.pid:
+            return client.is_spotify
+        if self.pid in (client.pid, client.sec_pid):
+            return True
+        if self.app_id is None:
+            return False
+        # The PID seen by pipewire is the one outside of the sandbox, where the app id can be read.
+        return self.app_id == (client.app_id or (flatpak_app_id(client.sec_pid) if client.sec_pid else None))
 
     def update(self):
         """Finds spotify's audio sinks."""
-        pactl_clients = self._extract_spotify_client()
-        log.debug("Spotify clients found: ["+", ".join(str(c) for c in pactl_clients)+"]")
+        if self.subscription is not None and self.subscription.poll() is None:
+            sinks = None if self.stale or self.pending else self._followed_sinks()
+            if not sinks:
+                # Missing changes, or a stream just created, e.g. for an ad, that pulse's event hasn't
+                # brought in yet: reads the state itself rather than finding nothing to mute.
+                self.stale = False
+                try:
+                    self._refresh_clients()
+                    self._refresh_sink_inputs()
+                except Exception:
+                    self.stale = True
+                    raise
+                sinks = self._followed_sinks()
+            self._set_sinks(sinks)
+            return
+        clients, sink_inputs = self.read_state()
+        pactl_clients = {client.id: client for client in clients if self.is_player(client)}
+        log.debug("Spotify clients found: ["+", ".join(str(c) for c in pactl_clients.values())+"]")
         # mute any spotify active client
-        self.sinks = [sink for client in pactl_clients for sink in client.sinks]
-        self.is_muted = any(sink.is_muted for sink in self.sinks)
+        self._set_sinks([sink for sink in sink_inputs if sink.client in pactl_clients])
+
+    def _followed_sinks(self) -> list["PulseSink"]:
+        clients = self.spotify_clients
+        return [sink for sink in self.sink_inputs.values() if sink.client in clients]
+
+    def _set_sinks(self, sinks: list["PulseSink"]):
+        self.sinks = sinks
+        self.is_muted = any(sink.is_muted for sink in sinks)
+        if sinks:
+            self.warned_no_sinks = False
+        elif self.pid and not self.warned_no_sinks:
+            # Once until some are found again: players without sound have none, but then there's nothing to mute.
+            self.warned_no_sinks = True
+            log.warning(f"No sink-inputs of the player with {self.player} found in pulse: it can't be muted. "
+                        "If it runs in a sandbox, its pulse clients may not report its process or app id.")
 
     def mute(self):
         if len(self.sinks) == 0:
-            log.error("No sink-inputs found for spotify. I can't mute.")
+            log.error(f"No sink-inputs found for {self.player}. I can't mute.")
             return
         for spotify_sink in self.sinks:
-            spotify_sink.mute()
+            spotify_sink.mute(self.pactl)
         self.is_muted = True
 
     def unmute(self):
         if len(self.sinks) == 0:
-            log.error("No sink-inputs found for spotify. I can't unmute.")
+            log.error(f"No sink-inputs found for {self.player}. I can't unmute.")
             return
         for spotify_sink in self.sinks:
-            spotify_sink.unmute()
+            spotify_sink.unmute(self.pactl)
         self.is_muted = False
 
+    def close(self):
+        subscription, self.subscription = self.subscription, None
+        if subscription is not None:
+            subscription.terminate()
+
     # def is_muted_all(self):
     #     for channel in self.channels:
     #         try:
@@ -104,39 +346,227 @@ class PulseMuter():
 
     #     self.update_audio_channel_state(["amixer", "-qD", "pulse", "set"], state)
 
-    def _extract_spotify_client(self):
-        pactl_out = subprocess.check_output(["pactl", "list", "clients"])
+    def read_state(self):
+        """Reads all the clients and sink-inputs, with a single pactl call each."""
+        return self._pactl_list("clients", PulseClient), self._pactl_list("sink-inputs", PulseSink)
+
+    def _pactl_list(self, what, item_class):
+        if self.use_json:
+            try:
+                pactl_out = spawn(subprocess.check_output, [*self.pactl, "-f", "json", "list", what],
+                                  stderr=subprocess.DEVNULL)
+                return [item_class.from_json(item) for item in json.loads(pactl_out)]
+            except (subprocess.CalledProcessError, ValueError) as e:
+                log.info(f"pactl does not support JSON output ({e}). Parsing its text output instead.")
+                self.use_json = False
+        pactl_out = spawn(subprocess.check_output, [*self.pactl, "list", what])
         if len(pactl_out) == 0:
-            log.debug("Received no output from 'pactl list clients'.")
+            log.debug(f"Received no output from 'pactl list {what}'.")
             return []
         output: str = pactl_out.decode("utf-8")
-        clients = [PulseClient(client) for client in output.split("\n\n")] # split("Client #")
-        spotify_clients = [client for client in clients if client.app.lower() == "spotify"]
-        return spotify_clients
+        return [item_class.from_text(block) for block in output.split("\n\n") if block.strip()]
+
+class PipeWireMuter():
+    # requires pipewire's pw-dump and pw-cli
+    # Times "pw-dump --monitor" is started again in a row, without listing anything, before giving up on it
+    max_restarts = 3
+
+    def __init__(self, fallback: PulseMuter | None = None):
+        for command in ("pw-dump", "pw-cli"):
+            if shutil.which(command) is None:
+                raise SystemCommandNotFound(command)
+        self.is_muted = False
+        # Mutes spotify when it has no stream node, e.g. if its audio goes through PulseAudio.
+        self.fallback = fallback
+        self.falling_back = False
+        # Spotify's stream nodes, kept up to date by "pw-dump --monitor": id -> muted
+        self.nodes: dict[int, bool] = {}
+        self.dumped = threading.Event()
+        self.monitor: subprocess.Popen | None = None
+        self.restarts = 0
+        self._start_monitor()
+        if not self.dumped.wait(timeout=2):
+            log.warning("pw-dump did not list PipeWire's objects in time.")
+
+    @staticmethod
+    def is_running() -> bool:
+        """Whether PipeWire runs and serves audio too, rather than only video next to PulseAudio."""
+        runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+        remote = os.environ.get("PIPEWIRE_REMOTE", "pipewire-0")
+        if runtime_dir is None or not (Path(runtime_dir)/remote).exists():
+            return False
+        if shutil.which("pactl") is None:
+            # Nothing to ask: nor to mute through, anyway.
+            return True
+        try:
+            info = spawn(subprocess.run, ["pactl", "info"], capture_output=True, text=True, timeout=2).stdout
+        except (OSError, subprocess.SubprocessError) as e:
+            log.warning(f"Cannot ask pulse which server it is: {e}")
+            return False
+        # e.g. "Server Name: PulseAudio (on PipeWire 0.3.48)"
+        return "on PipeWire" in info
+
+    def _start_monitor(self):
+        self.monitor = subprocess.Popen(["pw-dump", "--monitor"], stdout=subprocess.PIPE, text=True)
+        threading.Thread(target=self._follow_events, args=(self.monitor,), name="pw-dump", daemon=True).start()
+
+    def _follow_events(self, monitor: subprocess.Popen):
+        dump = []
+        first = True
+        for line in monitor.stdout:
+            dump.append(line)
+            # Every (pretty-printed) dump is a JSON array closed at the start of a line.
+            if line.rstrip() != "]":
+                continue
+            try:
+                objects = json.loads("".join(dump))
+                if first:
+                    # Lists all the objects: replaces what an earlier monitor found, removals included.
+                    nodes = {}
+                    self._apply(objects, nodes)
+                    self.nodes = nodes
+                    first = False
+                    self.restarts = 0
+                else:
+                    self._apply(objects, self.nodes)
+            except ValueError as e:
+                log.error(f"Cannot parse pw-dump output: {e}")
+            dump = []
+            self.dumped.set()
+        if self.monitor is not monitor:
+            return  # closed
+        if self.restarts < PipeWireMuter.max_restarts:
+            self.restarts += 1
+            log.warning(f"'pw-dump --monitor' exited. Starting it again ({self.restarts}/{PipeWireMuter.max_restarts}).")
+            # Gives PipeWire time to come back, if it restarted.
+            time.sleep(1)
+            if self.monitor is monitor:
+                self._start_monitor()
+        else:
+            self.monitor = None
+            log.error("'pw-dump --monitor' keeps exiting. Falling back to running pw-dump at every update.")
+
+    def _dump(self):
+        """Lists PipeWire's objects once, when they can't be monitored."""
+        try:
+            objects = json.loads(spawn(subprocess.check_output, ["pw-dump"], stderr=subprocess.DEVNULL))
+        except (subprocess.CalledProcessError, ValueError) as e:
+            log.error(f"pw-dump failed: {e}")
+            return
+        nodes = {}
+        self._apply(objects, nodes)
+        self.nodes = nodes
+
+    def _apply(self, objects: list[dict], nodes: dict[int, bool]):
+        for obj in objects:
+            node_id, info = obj.get("id"), obj.get("info")
+            if info is None:
+                # The object was removed.
+                nodes.pop(node_id, None)
+                continue
+            if obj.get("type") != "PipeWire:Interface:Node":
+                continue
+            props = info.get("props")
+            if props:
+                if not self._is_spotify_stream(props):
+                    nodes.pop(node_id, None)
+                    continue
+                nodes.setdefault(node_id, False)
+            if node_id not in nodes:
+                continue
+            for node_props in (info.get("params") or {}).get("Props") or []:
+                if "mute" in node_props:
+                    nodes[node_id] = bool(node_props["mute"])
+
+    @staticmethod
+    def _is_spotify_stream(props: dict) -> bool:
+        return (
+            str(props.get("media.class", "")).startswith("Stream/Output/Audio")
+            and "spotify" in (str(props.get("application.process.binary", "")).lower(),
+                              str(props.get("application.name", "")).lower())
+        )
+
+    def update(self):
+        """Spotify's streams are already tracked by pw-dump: nothing to spawn here, unless it can't monitor them."""
+        if self.monitor is None:
+            self._dump()
+        nodes = dict(self.nodes)
+        if self._use_fallback(not nodes):
+            self.fallback.update()
+            self.is_muted = self.fallback.is_muted
+            return
+        self.is_muted = any(nodes.values())
+
+    def _use_fallback(self, no_nodes: bool) -> bool:
+        falling_back = no_nodes and self.fallback is not None
+        if falling_back != self.falling_back:
+            self.falling_back = falling_back
+            if falling_back:
+                log.info("No PipeWire stream nodes found for spotify. Using its pulse sink-inputs.")
+            else:
+                log.info("Found spotify's PipeWire stream nodes. Using them.")
+        return falling_back
+
+    def mute(self):
+        self._set_mute(True)
+
+    def unmute(self):
+        self._set_mute(False)
+
+    def _set_mute(self, muted: bool):
+        nodes = list(dict(self.nodes))
+        if self._use_fallback(not nodes):
+            self.fallback.mute() if muted else self.fallback.unmute()
+            self.is_muted = self.fallback.is_muted
+            return
+        if len(nodes) == 0:
+            log.error(f"No stream nodes found for spotify. I can't {'mute' if muted else 'unmute'}.")
+            return
+        for node_id in nodes:
+            log.debug(f"{'Muting' if muted else 'Unmuting'} PipeWire node #{node_id}.")
+            props = f"{{ mute: {str(muted).lower()} }}"
+            spawn(subprocess.call, ["pw-cli", "set-param", str(node_id), "Props", props], stdout=subprocess.DEVNULL)
+            self.nodes[node_id] = muted
+        self.is_muted = muted
+
+    def close(self):
+        monitor, self.monitor = self.monitor, None
+        if monitor is not None:
+            monitor.terminate()
+        if self.fallback is not None:
+            self.fallback.close()
 
 class PulseSink():
-    # Match sink id and muted values from output of "pactl list sink-inputs"
-    pactl_sink_pattern = re.compile(r"(?:Sink Input #|Client|Corked|Mute).*?(\w+|\".+\")")
-    def __init__(self, sink_out):
-        index, client, corked, muted = PulseSink.pactl_sink_pattern.findall(sink_out)
-        # NOTE: previously we filtered out if index was false.
-        #       dunno when it could be zero/empty string, tho...
+    # Match sink id and the relevant fields, in any order, from output of "pactl list sink-inputs"
+    pactl_index_pattern = re.compile(r"Sink Input #(\d+)")
+    pactl_field_pattern = re.compile(r"^\s*(Client|Corked|Mute): (.*?)\s*$", re.MULTILINE)
+    def __init__(self, index: str, client: str, is_playing: bool, is_muted: bool):
         self.id: str = index # makes not sense to parse it to int
         self.client: str = client
-        self.is_playing: bool = corked == "no" # not used
-        self.is_muted: bool = muted != "no"
+        self.is_playing: bool = is_playing # not used
+        self.is_muted: bool = is_muted
+
+    @classmethod
+    def from_text(cls, sink_out: str):
+        index = cls.pactl_index_pattern.search(sink_out).group(1)
+        fields = dict(cls.pactl_field_pattern.findall(sink_out))
+        return cls(index, fields.get("Client", ""), fields.get("Corked") == "no", fields.get("Mute", "no") != "no")
+
+    @classmethod
+    def from_json(cls, sink: dict):
+        return cls(str(sink["index"]), str(sink.get("client", "")), not sink.get("corked"), bool(sink.get("mute")))
 
     def __repr__(self):
         return f"SinkInput#{self.id}(client={self.client}, muted={self.is_muted}, playing={self.is_playing})"
 
-    def mute(self):
+    def mute(self, pactl=("pactl",)):
         log.debug(f"Muting {self}")
-        subprocess.call(["pactl", "set-sink-input-mute", self.id, "yes"])
+        spawn(subprocess.call, [*pactl, "set-sink-input-mute", self.id, "yes"])
         self.is_muted = True
 
-    def unmute(self):
+    def unmute(self, pactl=("pactl",)):
         log.debug(f"Unmuting {self}.")
-        subprocess.call(["pactl", "set-sink-input-mute", self.id, "no"])
+        spawn(subprocess.call, [*pactl, "set-sink-input-mute", self.id, "no"])
         self.is_muted = False
 
     def toggle(self):
@@ -144,28 +574,36 @@ class PulseSink():
         self.unmute() if self.is_muted else self.mute()
 
 class PulseClient():
-    # Match client id and application.process.binary from output of "pactl list clients"
-    pactl_client_pattern = re.compile(r"(?:Client #|application\.process\.binary).*?(\w+|\".+\")")
-    string_value_pattern = re.compile(r"\"(.*?)\"")
-    def __init__(self, client_out):
-        index, application = PulseClient.pactl_client_pattern.findall(client_out)
+    # Match client id and the relevant properties from output of "pactl list clients"
+    pactl_index_pattern = re.compile(r"Client #(\d+)")
+    pactl_property_pattern = re.compile(
+        r"^\s*(application\.process\.binary|application\.process\.id|pipewire\.sec\.pid"
+        r"|pipewire\.access\.portal\.app_id) = \"(.*?)\"", re.MULTILINE)
+    def __init__(self, index: str, app: str, pid: str = "", sec_pid: str = "", app_id: str = ""):
         self.id: str = index
-        self.app: str = PulseClient.string_value_pattern.findall(application)[0]
+        self.app: str = app
+        self.pid: str = pid         # as the client reports it: inside its sandbox, if any
+        self.sec_pid: str = sec_pid # as pipewire found it from the socket, outside of any sandbox
+        self.app_id: str = app_id   # flatpak app id, as pipewire's portal access found it
+
+    @classmethod
+    def from_properties(cls, index: str, properties: dict):
+        return cls(index, properties.get("application.process.binary", ""),
+                   str(properties.get("application.process.id", "")), str(properties.get("pipewire.sec.pid", "")),
+                   properties.get("pipewire.access.portal.app_id", ""))
+
+    @classmethod
+    def from_text(cls, client_out: str):
+        index = cls.pactl_index_pattern.search(client_out).group(1)
+        return cls.from_properties(index, dict(cls.pactl_property_pattern.findall(client_out)))
+
+    @classmethod
+    def from_json(cls, client: dict):
+        return cls.from_properties(str(client["index"]), client.get("properties", {}))
 
     def __repr__(self):
-        return f"PulseClient#{self.id}(app={self.app})"
+        return f"PulseClient#{self.id}(app={self.app}, pid={self.pid}, sec_pid={self.sec_pid}, app_id={self.app_id})"
 
     @property
-    def sinks(self) -> list[PulseSink]:
-        sinks_status = _extract_pactl_sinks()
-        client_sinks = [status for status in sinks_status if status.client == self.id]
-        return client_sinks
-
-def _extract_pactl_sinks():
-    pactl_out = subprocess.check_output(["pactl", "list", "sink-inputs"])
-    if len(pactl_out) == 0:
-        log.debug("Received no output from 'pactl list sink-inputs'.")
-        return []
-    output: str = pactl_out.decode("utf-8")
-    sinks_status = [PulseSink(sink) for sink in output.split("\n\n")] # split("Sink Input #")
-    return sinks_status
\ No newline at end of file
+    def is_spotify(self) -> bool:
+        return self.app.lower() == "spotify"
\ No newline at end of file
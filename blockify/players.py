@@ -0,0 +1,184 @@
+import fnmatch
+import logging
+import time
+
+import dbus
+import dbus.exceptions
+
+from blockify import dbusclient, metrics, util
+from blockify.cli import Blockify, DecisionCache
+from blockify.mainloops import GLibMainLoop
+from blockify.muters import PulseMuter, SystemCommandNotFound
+
+log = logging.getLogger("players")
+
+MPRIS_PREFIX = "org.mpris.MediaPlayer2."
+
+
+class PlayerBlockify(Blockify):
+    """Blockify's pipeline for one of the players followed by MultiBlockify or SupervisorBlockify.
+
+    It shares the main loop and the blocklist with the other players. If pid is
+    given, it only mutes the sink-inputs of that process, or of its flatpak app if
+    it is sandboxed. If decisions is given,
+    the cache of blocking decisions is shared too.
+    """
+    def __init__(self, blocklist, main_loop, bus, bus_name: str = "org.mpris.MediaPlayer2.spotify",
+                 pid: str | None = None, pulse_server: str | None = None, decisions=None):
+        self.shared_main_loop = main_loop
+        self.bus = bus
+        self.bus_name = bus_name
+        self.pid = pid
+        self.pulse_server = pulse_server
+        self.last_checked = 0.0     # monotonic time of the last check
+        super().__init__(blocklist)
+        if decisions is not None:
+            self.decisions = decisions
+
+    def create_main_loop(self):
+        return self.shared_main_loop
+
+    def choose_muter(self):
+        return PulseMuter(subscribe=util.CONFIG["cli"]["pulse_subscribe"], pid=self.pid, server=self.pulse_server)
+
+    def connect_to_spotify(self):
+        self.spotify = dbusclient.SpotifyDBusClient(self.bus_name)
+        self.spotify.on_connected(self.spotify_connected)
+        self.spotify.connect(self.bus)
+        return self.spotify
+
+    def check_spotify(self, changed_metadata=None):
+        self.last_checked = time.monotonic()
+        super().check_spotify(changed_metadata)
+
+    def close(self):
+        for match in self.signal_matches:
+            match.remove()
+        self.cancel_premute()
+        self.spotify.close()
+        self.muter.close()
+
+
+class MultiBlockify(Blockify):
+    """Follows every MPRIS player whose bus name matches the "players" option, on a single connection.
+
+    Each player has its own PlayerBlockify, so an event only concerns the state and
+    the sink-inputs of the player that sent it. Signals act on the player that
+    changed song last.
+    """
+    def __init__(self, blocklist):
+        self.blocklist = blocklist
+        self.patterns = [pattern.strip() for pattern in util.CONFIG["cli"]["players"].split(",") if pattern.strip()]
+        if util.CONFIG["cli"]["dbus_backend"] != "dbus-python":
+            log.warning("Multiple players are only supported with the dbus-python backend. Using it.")
+        self.main_loop = GLibMainLoop()
+        self.decisions = DecisionCache(util.CONFIG["cli"]["decision_cache_size"])
+        self.players: dict[str, PlayerBlockify] = {}
+        self.started = False
+        self.control = None
+        self.bus = dbus.SessionBus()
+        self.bus_daemon = dbus.Interface(self.bus.get_object("org.freedesktop.DBus", "/org/freedesktop/DBus"),
+                                         "org.freedesktop.DBus")
+        self.bus.add_signal_receiver(
+            self.name_owner_changed,
+            signal_name="NameOwnerChanged",
+            dbus_interface="org.freedesktop.DBus",
+            bus_name="org.freedesktop.DBus",
+            path="/org/freedesktop/DBus",
+        )
+        for name in self.bus.list_names():
+            if self.is_followed(name):
+                self.add_player(str(name))
+        log.info(f"Following players matching {', '.join(self.patterns)}: {len(self.players)} running.")
+
+    def is_followed(self, bus_name: str) -> bool:
+        return bus_name.startswith(MPRIS_PREFIX) and any(
+            fnmatch.fnmatchcase(bus_name[len(MPRIS_PREFIX):], pattern) for pattern in self.patterns)
+
+    def name_owner_changed(self, bus_name, old_owner, new_owner):
+        if not self.is_followed(bus_name):
+            return
+        if old_owner:
+            self.remove_player(str(bus_name))
+        if new_owner:
+            self.add_player(str(bus_name))
+
+    def add_player(self, bus_name: str):
+        try:
+            pid = str(self.bus_daemon.GetConnectionUnixProcessID(bus_name))
+        except dbus.exceptions.DBusException as e:
+            log.error(f"Cannot find the process of {bus_name}: {e}")
+            return
+        try:
+            player = PlayerBlockify(self.blocklist, self.main_loop, self.bus, bus_name, pid=pid,
+                                    decisions=self.decisions)
+        except SystemCommandNotFound as e:
+            log.error(f"No command '{e.command}' found. Multiple players can only be muted through pulse.")
+            return
+        log.info(f"Following {bus_name} ({player.muter.player}).")
+        self.players[bus_name] = player
+        if self.started:
+            player.follow_spotify()
+
+    def remove_player(self, bus_name: str):
+        player = self.players.pop(bus_name, None)
+        if player is not None:
+            log.info(f"{bus_name} left the bus.")
+            player.close()
+
+    @property
+    def active_player(self) -> PlayerBlockify | None:
+        return max(self.players.values(), key=lambda player: player.last_checked, default=None)
+
+    @property
+    def current_song(self) -> str:
+        player = self.active_player
+        return player.current_song if player else ""
+
+    def start(self):
+        self.bind_signals()
+        self.control = self.open_control()
+        self.start_metrics()
+        self.started = True
+        for player in self.players.values():
+            player.follow_spotify()
+        log.info("Blockify started.")
+        self.main_loop.run()
+
+    def toggle(self):
+        if self.active_player:
+            self.active_player.toggle()
+
+    def block_current(self):
+        if self.active_player:
+            self.active_player.block_current()
+
+    def unblock_current(self) -> bool:
+        return self.active_player is not None and self.active_player.unblock_current()
+
+    def reload(self):
+        self.blocklist.reload()
+        for player in self.players.values():
+            if player.spotify.is_connected:
+                player.check_spotify()
+
+    def status(self) -> dict:
+        player = self.active_player
+        status = player.status() if player else {"song": "", "connected": False, "blocking": False, "muted": False}
+        status["players"] = len(self.players)
+        return status
+
+    def prepare_stop(self):
+        log.warning("Exiting safely. Bye.")
+        if self.control is not None:
+            self.control.close()
+        if metrics.enabled:
+            self.write_metrics()
+        # Save whatever of the blocklist was not persisted yet.
+        self.blocklist.close()
+        log.info(f"Decision cache: {self.decisions.hits} hits, {self.decisions.misses} misses.")
+        for player in self.players.values():
+            # Unmute before exiting.
+            player.unmute()
+            player.blocking = False
+            player.close()
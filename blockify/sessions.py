@@ -0,0 +1,106 @@
+import logging
+
+import dbus.bus
+import dbus.exceptions
+
+from blockify import util
+from blockify.cli import DecisionCache
+from blockify.mainloops import GLibMainLoop
+from blockify.muters import SystemCommandNotFound
+from blockify.players import MultiBlockify, PlayerBlockify
+
+log = logging.getLogger("sessions")
+
+RETRY_INTERVAL = 10000  # ms between attempts to connect to the sessions whose bus is not up
+
+
+def read_sessions(path: str) -> list[tuple[str, str | None]]:
+    """Reads the sessions file: one "<bus address> [<pulse server>]" per line, # for comments."""
+    sessions = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) > 2:
+                log.error(f"Ignoring invalid session in {path}: {line.strip()}")
+                continue
+            sessions.append((fields[0], fields[1] if len(fields) == 2 else None))
+    return sessions
+
+
+class SupervisorBlockify(MultiBlockify):
+    """Follows Spotify in many user sessions at once, on a single main loop.
+
+    Each session is a session bus address, e.g. the DBUS_SESSION_BUS_ADDRESS of a
+    container, and optionally the pulse server its audio goes to, as in PULSE_SERVER.
+    Every session gets its own bus connection and PlayerBlockify, while the process,
+    the main loop, the blocklist and the decision cache are shared.
+    """
+    def __init__(self, blocklist):
+        self.blocklist = blocklist
+        if util.CONFIG["cli"]["dbus_backend"] != "dbus-python":
+            log.warning("Multiple sessions are only supported with the dbus-python backend. Using it.")
+        self.main_loop = GLibMainLoop()
+        self.decisions = DecisionCache(util.CONFIG["cli"]["decision_cache_size"])
+        self.players: dict[str, PlayerBlockify] = {}    # by bus address
+        self.started = False
+        self.control = None
+        self.pending = read_sessions(util.CONFIG["cli"]["sessions"])
+        self.retry_timer = None
+        self.connect_sessions()
+        log.info(f"Supervising {len(self.players)} sessions, {len(self.pending)} not reachable yet.")
+
+    def connect_sessions(self) -> bool:
+        pending = []
+        for address, pulse_server in self.pending:
+            if not self.add_session(address, pulse_server):
+                pending.append((address, pulse_server))
+        self.pending = pending
+        if pending and self.retry_timer is None:
+            self.retry_timer = self.main_loop.timeout_add(RETRY_INTERVAL, self.connect_sessions)
+        elif not pending:
+            self.retry_timer = None
+        # Keeps retrying as long as some session is missing.
+        return bool(pending)
+
+    def add_session(self, address: str, pulse_server: str | None) -> bool:
+        try:
+            bus = dbus.bus.BusConnection(address)
+        except dbus.exceptions.DBusException as e:
+            log.debug(f"Cannot connect to the session bus at {address}: {e}")
+            return False
+        # A session going away must not take the others with it.
+        bus.set_exit_on_disconnect(False)
+        try:
+            player = PlayerBlockify(self.blocklist, self.main_loop, bus, pulse_server=pulse_server,
+                                    decisions=self.decisions)
+        except SystemCommandNotFound as e:
+            log.error(f"No command '{e.command}' found. Sessions can only be muted through pulse.")
+            bus.close()
+            # Retrying won't make pactl appear.
+            return True
+        log.info(f"Following Spotify in the session at {address}.")
+        self.players[address] = player
+        bus.call_on_disconnection(lambda _: self.remove_session(address, pulse_server))
+        if self.started:
+            player.follow_spotify()
+        return True
+
+    def remove_session(self, address: str, pulse_server: str | None):
+        player = self.players.pop(address, None)
+        if player is None:
+            return
+        log.warning(f"Lost the session bus at {address}.")
+        player.close()
+        self.pending.append((address, pulse_server))
+        if self.retry_timer is None:
+            self.retry_timer = self.main_loop.timeout_add(RETRY_INTERVAL, self.connect_sessions)
+
+    def prepare_stop(self):
+        if self.retry_timer is not None:
+            self.main_loop.source_remove(self.retry_timer)
+            self.retry_timer = None
+        super().prepare_stop()
+        for player in self.players.values():
+            player.bus.close()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""blockify-trace
+
+Prints the records of blockify's event trace, oldest first: player events,
+decisions, timers and mutes, with the time they took.
+
+Usage:
+    blockify-trace [dump] [-n <count>] [-f <path>]
+    blockify-trace tail [-n <count>] [-f <path>] [-i <ms>]
+
+Options:
+    -n, --count=<count>     Print only the latest count records.
+    -f, --file=<path>       Trace file [default: {trace}].
+    -i, --interval=<ms>     How often tail looks for new records [default: 200].
+    -h, --help              Show this help text.
+    --version               Show current version of blockify-trace.
+"""
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+
+from enum import IntEnum
+
+from blockify import util
+
+log = logging.getLogger("trace")
+
+MAGIC = b"BLKTRACE"
+FORMAT_VERSION = 1
+# magic, format version, record size, capacity, records written so far, offset from the monotonic clock to the epoch
+HEADER = struct.Struct("<8sIIIqd")
+WRITTEN_OFFSET = struct.calcsize("<8sIII")
+# monotonic time (ns), crc32 of the track id, duration (us), kind, decision, action
+RECORD = struct.Struct("<qIIBBBx")
+
+
+class Kind(IntEnum):
+    PROPERTIES_CHANGED = 1
+    SEEKED = 2
+    CONNECTED = 3
+    CLOSED = 4
+    CHECK = 5
+    MUTE = 6
+    UNMUTE = 7
+    PREMUTE = 8
+    UNMUTE_TIMER = 9
+
+
+class Decision(IntEnum):
+    NONE = 0
+    PLAY = 1
+    BLOCK = 2
+
+
+class Action(IntEnum):
+    NONE = 0
+    MUTE = 1
+    UNMUTE = 2
+    SKIPPED = 3     # the muter was already in the requested state
+
+
+enabled = False
+writer: "TraceFile | None" = None
+
+
+class TraceFile(object):
+    """Fixed-size ring buffer of trace records, in a memory-mapped file.
+
+    The header holds the number of records written so far, which is updated after
+    each record: readers find the latest records from it, even while blockify runs
+    and after it crashed.
+    """
+    def __init__(self, path: os.PathLike | str, capacity: int = 0, writable: bool = False):
+        self.path = str(path)
+        size = HEADER.size + capacity * RECORD.size
+        fd = os.open(self.path, (os.O_RDWR | os.O_CREAT) if writable else os.O_RDONLY, 0o600)
+        try:
+            header = os.pread(fd, HEADER.size, 0)
+            fields = HEADER.unpack(header) if len(header) == HEADER.size else None
+            valid = fields is not None and fields[:3] == (MAGIC, FORMAT_VERSION, RECORD.size)
+            if writable and not (valid and fields[3] == capacity and os.fstat(fd).st_size == size):
+                # Missing, corrupted or resized: starts over.
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                fields = (MAGIC, FORMAT_VERSION, RECORD.size, capacity, 0, 0.0)
+            elif not valid:
+                raise ValueError(f"{self.path} is not a blockify trace")
+            self.capacity = fields[3]
+            self.written = fields[4]
+            self.map = mmap.mmap(fd, HEADER.size + self.capacity * RECORD.size,
+                                 access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        if writable:
+            # The monotonic clock of this boot, for the records written from now on.
+            HEADER.pack_into(self.map, 0, MAGIC, FORMAT_VERSION, RECORD.size, self.capacity, self.written,
+                             time.time() - time.monotonic())
+
+    def write(self, kind: Kind, track_id: str, decision: Decision, action: Action, duration: float):
+        offset = HEADER.size + (self.written % self.capacity) * RECORD.size
+        RECORD.pack_into(self.map, offset, time.monotonic_ns(), zlib.crc32(track_id.encode()) if track_id else 0,
+                         min(int(duration * 1_000_000), 0xFFFFFFFF), kind, decision, action)
+        self.written += 1
+        struct.pack_into("<q", self.map, WRITTEN_OFFSET, self.written)
+
+    def header(self) -> tuple[int, float]:
+        """Reads the number of records written so far and the clock offset."""
+        *_, written, clock_offset = HEADER.unpack_from(self.map, 0)
+        return written, clock_offset
+
+    def read(self, start: int, end: int):
+        """Yields the records from number start to end, excluded, as long as they weren't overwritten."""
+        for number in range(max(start, end - self.capacity), end):
+            yield RECORD.unpack_from(self.map, HEADER.size + (number % self.capacity) * RECORD.size)
+
+    def close(self):
+        self.map.close()
+
+
+def enable(path: os.PathLike | str, capacity: int):
+    global enabled, writer
+    try:
+        writer = TraceFile(path, capacity, writable=True)
+    except (OSError, ValueError) as e:
+        log.error(f"Cannot open the trace file {path}: {e}")
+        return
+    enabled = True
+    log.info(f"Tracing the last {capacity} events to {path}.")
+
+
+def record(kind: Kind, track_id: str = "", decision: Decision = Decision.NONE, action: Action = Action.NONE,
+           duration: float = 0.0):
+    writer.write(kind, track_id, decision, action, duration)
+
+
+def format_record(record: tuple, clock_offset: float) -> str:
+    # Only the reader needs it: blockify imports this module at startup.
+    from datetime import datetime
+    timestamp, track_hash, duration, kind, decision, action = record
+    seconds = timestamp / 1e9
+    wall_time = datetime.fromtimestamp(seconds + clock_offset).isoformat(sep=" ", timespec="milliseconds")
+    fields = [wall_time, f"{seconds:.6f}", Kind(kind).name]
+    if track_hash:
+        fields.append(f"track={track_hash:08x}")
+    if decision:
+        fields.append(f"decision={Decision(decision).name}")
+    if action:
+        fields.append(f"action={Action(action).name}")
+    if duration:
+        fields.append(f"took={duration / 1000:.3f}ms")
+    return " ".join(fields)
+
+
+def main():
+    args = util.docopt(__doc__.format(trace=util.TRACE_FILE), version=util.Version("blockify-trace"))
+    try:
+        trace_file = TraceFile(args["--file"])
+    except (OSError, ValueError) as e:
+        print(f"Cannot read the trace: {e}", file=sys.stderr)
+        sys.exit(1)
+    written, clock_offset = trace_file.header()
+    start = max(0, written - trace_file.capacity)
+    if args["--count"]:
+        start = max(start, written - int(args["--count"]))
+    try:
+        while True:
+            if written - start > trace_file.capacity:
+                print(f"# {written - start - trace_file.capacity} records overwritten before being read", flush=True)
+            for record in trace_file.read(start, written):
+                print(format_record(record, clock_offset))
+            sys.stdout.flush()
+            if not args["tail"]:
+                break
+            start = written
+            while written == start:
+                time.sleep(int(args["--interval"]) / 1000)
+                written, clock_offset = trace_file.header()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        trace_file.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 import codecs
 import configparser
-import importlib.metadata
 import logging
 import os
 import sys
@@ -14,7 +13,6 @@ try:
 except ImportError:
     log.error("ImportError: Please install docopt to use the DBus CLI.")
 
-VERSION = importlib.metadata.version("blockify")
 CONFIG = None
 if "XDG_CONFIG_HOME" in os.environ:
     CONFIG_DIR = Path(os.environ["XDG_CONFIG_HOME"])/"blockify"
@@ -22,6 +20,35 @@ else:
     CONFIG_DIR = Path.home()/".config"/"blockify"
 CONFIG_FILE = CONFIG_DIR/"blockify.ini"
 BLOCKLIST_FILE = CONFIG_DIR/"blocklist.txt"
+BLOCKLIST_JOURNAL_FILE = CONFIG_DIR/"blocklist.journal"
+BLOCKLIST_DB_FILE = CONFIG_DIR/"blocklist.sqlite3"
+TRACE_FILE = CONFIG_DIR/"trace.bin"
+if "XDG_RUNTIME_DIR" in os.environ:
+    CONTROL_SOCKET_FILE = Path(os.environ["XDG_RUNTIME_DIR"])/"blockify.sock"
+else:
+    CONTROL_SOCKET_FILE = CONFIG_DIR/"blockify.sock"
+
+def __getattr__(name):
+    if name == "VERSION":
+        return get_version()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_version() -> str:
+    # importlib.metadata takes longer to import than the rest of blockify: only when needed.
+    import importlib.metadata
+    return importlib.metadata.version("blockify")
+
+
+class Version(object):
+    """Version to pass to docopt, looked up only if --version is actually given."""
+
+    def __init__(self, program: str):
+        self.program = program
+
+    def __str__(self):
+        return f"{self.program} {get_version()}"
+
 
 class StreamToLogger(object):
     """
@@ -90,9 +117,24 @@ def default_options() -> dict:
         "general": {
             "autoplay": True,
             "substring_search": False,
+            "watch_blocklist": True,
+            "blocklist_journal": False,
+            "blocklist_storage": "text",
         },
         "cli": {
-            "unmute_delay": 700
+            "unmute_delay": 700,
+            "decision_cache_size": 128,
+            "muter": "auto",
+            "pulse_subscribe": False,
+            "premute_ahead": 0,
+            "dbus_backend": "dbus-python",
+            "coalesce_window": 5,
+            "players": "",
+            "sessions": "",
+            "control_socket": True,
+            "metrics_file": "",
+            "metrics_interval": 15,
+            "trace_records": 16384,
         },
     }
 
@@ -119,6 +161,9 @@ def load_options():
 
 def read_option(config, section_name, option_name, option_value, default_option_value):
     option = None
+    if not config.has_option(section_name, option_name):
+        # Missing from configuration files written before the option existed.
+        return option
     try:
         if isinstance(option_value, bool):
             option = config.getboolean(section_name, option_name)